@@ -1,46 +1,121 @@
-# Every level/folder of a Python application has an __init__.py file. 
+# Every level/folder of a Python application has an __init__.py file.
 # The purpose of this file is to connect the levels
-# of the app to each other. 
-from mongoengine import connect
+# of the app to each other.
+#
+# Importing this package only makes the Flask 'app' object. Nothing is connected and no
+# secrets are read until create_app() is called (main.py does that). This keeps imports
+# fast for tests and tools, and lets a server like gunicorn load the app once and then
+# 'fork' (copy) it in to several worker processes that each open their own database
+# connection the first time they need it.
+from mongoengine import register_connection
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 from flask_moment import Moment
-import base64
 from flask_login import LoginManager
 from flask_mail import Mail
 import certifi
 
 app = Flask(__name__)
 #app.jinja_options['extensions'].append('jinja2.ext.do')
-app.config["SECRET_KEY"] = os.environ.get("FLASK_SECRET_KEY") or os.urandom(20)
 
-from app.utils.secrets import getSecrets
-
-secrets = getSecrets()
-
-connect(secrets['MONGO_DB_NAME'], host=secrets['MONGO_HOST'], tlsCAFile=certifi.where())
 moment = Moment(app)
 
 login = LoginManager(app)
 login.login_view = 'login'
 
-app.config.update(dict(
-   DEBUG = True,
+mail = Mail()
+
+# These are the settings for the database connection. They can be changed by passing
+# a config dictionary to create_app().
+DEFAULT_CONFIG = dict(
+   DEBUG = False,
+   # The largest number of connections each worker process keeps open to MongoDB
+   MONGO_MAX_POOL_SIZE = 50,
+   MONGO_MIN_POOL_SIZE = 0,
+   # How long (in milliseconds) to wait to find a MongoDB server, to connect to it
+   # and for an answer before giving up
+   MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000,
+   MONGO_CONNECT_TIMEOUT_MS = 5000,
+   MONGO_SOCKET_TIMEOUT_MS = 20000,
+   # The certificates used to check the MongoDB server. Set to None for a local
+   # MongoDB that doesn't use TLS.
+   MONGO_TLS_CA_FILE = certifi.where(),
+   # The biggest request (in bytes) the site accepts, which limits the size of uploads.
+   # Bigger requests get a '413 Request Entity Too Large' error.
+   MAX_CONTENT_LENGTH = 16 * 1024 * 1024,
+   # The number of proxies or load balancers in front of the site. Each one adds the
+   # address it got the request from to the X-Forwarded-For header. With 0 the headers
+   # are ignored and every visitor looks like the proxy, which would put everyone in one
+   # login throttle (see app/utils/passwords.py). Never set it higher than the real
+   # number of proxies or visitors can pretend to be any address.
+   PROXY_COUNT = int(os.environ.get('PROXY_COUNT', 0)),
    MAIL_SERVER = 'smtp.googlemail.com',
    MAIL_PORT = 587,
    MAIL_USE_TLS = 1,
    MAIL_USE_SSL = 0,
-   MAIL_USERNAME = secrets['MAIL_USERNAME'],
-   MAIL_PASSWORD = secrets['MAIL_PASSWORD']
-))
+)
+
+_created = False
+
+# This sets up the app. config is an optional dictionary of settings that replace the
+# defaults and the values from app/utils/secrets.py
+def create_app(config=None):
+    global _created
+    config = dict(config or {})
+    # These environment variables point the site at another MongoDB, for example the
+    # benchmark database (see bench/readme.txt). An empty MONGO_TLS_CA_FILE turns TLS off.
+    for name in ('MONGO_HOST', 'MONGO_DB_NAME', 'MONGO_TLS_CA_FILE'):
+        if name in os.environ and name not in config:
+            config[name] = os.environ[name] or None
+    if _created:
+        app.config.update(config)
+        return app
+
+    app.config.update(DEFAULT_CONFIG)
+    app.config["SECRET_KEY"] = os.environ.get("FLASK_SECRET_KEY") or os.urandom(20)
+    if 'MONGO_HOST' not in config:
+        from app.utils.secrets import getSecrets
+        secrets = getSecrets()
+        app.config.update(
+            MONGO_DB_NAME = secrets['MONGO_DB_NAME'],
+            MONGO_HOST = secrets['MONGO_HOST'],
+            MAIL_USERNAME = secrets['MAIL_USERNAME'],
+            MAIL_PASSWORD = secrets['MAIL_PASSWORD']
+        )
+    app.config.update(config)
+
+    # This makes request.remote_addr and request.scheme the visitor's instead of the proxy's
+    if app.config['PROXY_COUNT']:
+        proxies = app.config['PROXY_COUNT']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
-mail = Mail(app)
+    # This counts the database commands sent by each request. It has to be set up
+    # before the database connection is made. See app/utils/dbmetrics.py
+    from app.utils.dbmetrics import registerListener
+    registerListener()
 
-def base64encode(img):
-    image = base64.b64encode(img)
-    image = image.decode('utf-8')
-    return image
+    # register_connection() only remembers the settings. The real connection is made by
+    # mongoengine the first time a query runs, which is after gunicorn has forked.
+    tls = {'tlsCAFile': app.config['MONGO_TLS_CA_FILE']} if app.config['MONGO_TLS_CA_FILE'] else {}
+    register_connection('default',
+        # if there is no name the database named in MONGO_HOST is used
+        db = app.config.get('MONGO_DB_NAME'),
+        host = app.config['MONGO_HOST'],
+        maxPoolSize = app.config['MONGO_MAX_POOL_SIZE'],
+        minPoolSize = app.config['MONGO_MIN_POOL_SIZE'],
+        serverSelectionTimeoutMS = app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        connectTimeoutMS = app.config['MONGO_CONNECT_TIMEOUT_MS'],
+        socketTimeoutMS = app.config['MONGO_SOCKET_TIMEOUT_MS'],
+        **tls
+    )
 
-app.jinja_env.globals.update(base64encode=base64encode)
+    mail.init_app(app)
 
-from .routes import *
\ No newline at end of file
+    from . import routes
+    from . import commands
+    # This compresses responses. It is imported last so that it runs before the
+    # after_request functions of the other files (flask runs them newest first).
+    from .utils import compression
+    _created = True
+    return app
@@ -0,0 +1,42 @@
+# This is a second web server for the pages that are read the most: the post list, a
+# post with its comments, a story page, the list of story pages and the pictures.
+#
+# The Flask site answers each request with a thread, and the thread waits while MongoDB
+# works, so a worker can only wait on as many reads at once as it has threads (see
+# gunicorn.conf.py). This server uses asyncio instead: it starts a read, answers other
+# requests while it waits and carries on when the answer comes back. It talks to
+# MongoDB with motor, the asyncio MongoDB driver, and renders the same templates.
+#
+# It runs NEXT TO the Flask site, which still has every page (including these ones).
+# A proxy in front of both sends the GET requests for these urls here and everything
+# else (logging in, forms, changes) to the Flask site. For example with nginx:
+#     location ~ ^/(post/list|post/[0-9a-f]{24}|page/[0-9a-f]{24}|pages|image/.+)$ {
+#         proxy_pass http://127.0.0.1:8001;
+#     }
+# Both servers must use the same FLASK_SECRET_KEY so that this one can read the login
+# cookie. Start it with asyncmain.py.
+
+from aiohttp import web
+from app import create_app
+
+# This returns the aiohttp app. config is passed to create_app(). client is a motor
+# client to use instead of making one from MONGO_HOST (the tests use this).
+def createAsyncApp(config=None, client=None):
+    create_app(config)
+    from app.asyncread import db, views
+    webApp = web.Application(middlewares=[views.httpErrors])
+    webApp.router.add_routes(views.routes)
+
+    # The client is made when the server starts because motor has to be started inside
+    # the running event loop, and after gunicorn has forked the worker.
+    async def connect(webApp):
+        webApp['client'] = client or db.connect()
+        webApp['db'] = db.getDatabase(webApp['client'])
+
+    async def disconnect(webApp):
+        if client is None:
+            webApp['client'].close()
+
+    webApp.on_startup.append(connect)
+    webApp.on_cleanup.append(disconnect)
+    return webApp
@@ -0,0 +1,206 @@
+# The database side of the async read server. These are the same reads as the Flask
+# routes in forum.py and story.py, sent with motor (the asyncio MongoDB driver) instead
+# of mongoengine. The filters come from the same helpers as the Flask routes:
+# Q(...).to_query(Post) turns a mongoengine filter in to the plain MongoDB one.
+#
+# The results are turned in to mongoengine documents (like usercache.py does) so the
+# templates can use them exactly like on the Flask site. A reference that isn't filled
+# in here would make mongoengine go to the database itself, which would stop the whole
+# server while it waits, so every reference a template uses is filled in (or None).
+
+import asyncio
+import os
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+from cachetools import TTLCache
+from flask import abort
+from app import app
+from app.classes.data import User, Post, Comment, StoryPage
+from app.routes.forum import (SORT_FIELDS, MAX_POSTS_PER_PAGE, AUTHOR_FIELDS, REPLY_COUNTS, cursorQuery,
+                              encodeCursor, threadsFilter, threadRepliesFilter, truncatedThreads)
+from app.utils.storygraph import NODE_FIELDS
+from app.utils.usercache import USER_FIELDS
+
+USERS = User._get_collection_name()
+POSTS = Post._get_collection_name()
+COMMENTS = Comment._get_collection_name()
+PAGES = StoryPage._get_collection_name()
+# Where mongoengine's FileField keeps uploads (GridFS)
+FILES = 'fs.files'
+CHUNKS = 'fs.chunks'
+# How many 255kB pieces of a picture are read from the database at a time
+CHUNK_BATCH = 4
+
+# This makes the motor client when the server starts. motor has to be started inside
+# the running event loop, which is why this isn't done when the file is imported.
+def connect():
+    # motor 2 still uses pymongo underneath, in a pool of threads that is 5 per CPU
+    # unless MOTOR_MAX_WORKERS says otherwise. That is how many reads can wait at once,
+    # so it is made as big as the connection pool. It is read when motor is imported.
+    os.environ.setdefault('MOTOR_MAX_WORKERS', str(app.config['MONGO_MAX_POOL_SIZE']))
+    from motor.motor_asyncio import AsyncIOMotorClient
+    if app.config['MONGO_HOST'].startswith('mongomock://'):
+        raise RuntimeError('The async read server needs a real MongoDB, not mongomock.')
+    tls = {'tlsCAFile': app.config['MONGO_TLS_CA_FILE']} if app.config['MONGO_TLS_CA_FILE'] else {}
+    return AsyncIOMotorClient(app.config['MONGO_HOST'],
+        maxPoolSize = app.config['MONGO_MAX_POOL_SIZE'],
+        minPoolSize = app.config['MONGO_MIN_POOL_SIZE'],
+        serverSelectionTimeoutMS = app.config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        connectTimeoutMS = app.config['MONGO_CONNECT_TIMEOUT_MS'],
+        socketTimeoutMS = app.config['MONGO_SOCKET_TIMEOUT_MS'],
+        **tls
+    )
+
+# The database named by MONGO_DB_NAME, or the one in MONGO_HOST if there is no name
+def getDatabase(client):
+    name = app.config.get('MONGO_DB_NAME')
+    return client[name] if name else client.get_default_database()
+
+def toObjectId(value):
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+async def findAll(collection, *args, **kwargs):
+    return await collection.find(*args, **kwargs).to_list(None)
+
+# This keeps recently seen users for USER_CACHE_TTL seconds, like usercache.py does for
+# the Flask site. The server has one thread so it doesn't need a lock.
+_users = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+# This returns a User with just USER_FIELDS filled in, or None if there is no such user
+async def getUser(db, userID):
+    userID = toObjectId(userID)
+    if userID is None:
+        return None
+    son = _users.get(userID)
+    if son is None:
+        son = await db[USERS].find_one({'_id': userID}, USER_FIELDS)
+        if son is None:
+            return None
+        _users[userID] = son
+    return User._from_son(dict(son), only_fields=USER_FIELDS)
+
+# Like loadAuthors() in forum.py: one query for the authors of all of docs
+async def loadAuthors(db, docs):
+    refs = [doc._data.get('author') for doc in docs]
+    ids = {ref.id for ref in refs if isinstance(ref, DBRef)}
+    authors = {}
+    if ids:
+        for son in await findAll(db[USERS], {'_id': {'$in': list(ids)}}, AUTHOR_FIELDS):
+            authors[son['_id']] = User._from_son(son, only_fields=AUTHOR_FIELDS)
+    for doc, ref in zip(docs, refs):
+        # an author that is gone becomes None so the template never looks it up itself
+        doc._data['author'] = authors.get(ref.id) if isinstance(ref, DBRef) else None
+    return docs
+
+# Like getPostPage() in forum.py
+async def getPostPage(db, after=None, before=None, size=None, sort='newest'):
+    field = SORT_FIELDS.get(sort, 'createdate')
+    size = min(max(size or app.config['POSTS_PER_PAGE'], 1), MAX_POSTS_PER_PAGE)
+    if before:
+        sons = await findAll(db[POSTS], cursorQuery(before, field, older=False).to_query(Post),
+                             sort=[(field, 1), ('_id', 1)], limit=size + 1)
+        hasMore = len(sons) > size
+        posts = [Post._from_son(son) for son in reversed(sons[:size])]
+        await loadAuthors(db, posts)
+        if posts:
+            return posts, encodeCursor(posts[-1], field), encodeCursor(posts[0], field) if hasMore else None
+        after = None
+
+    query = cursorQuery(after, field).to_query(Post) if after else {}
+    sons = await findAll(db[POSTS], query, sort=[(field, -1), ('_id', -1)], limit=size + 1)
+    hasMore = len(sons) > size
+    posts = [Post._from_son(son) for son in sons[:size]]
+    await loadAuthors(db, posts)
+    nextCursor = encodeCursor(posts[-1], field) if hasMore else None
+    prevCursor = encodeCursor(posts[0], field) if after and posts else None
+    return posts, nextCursor, prevCursor
+
+async def getPost(db, postID):
+    son = await db[POSTS].find_one({'_id': postID})
+    return Post._from_son(son) if son else None
+
+# Like getCommentPage() in forum.py
+async def getCommentPage(db, postID, after=None):
+    size = app.config['THREADS_PER_PAGE']
+    sons = await findAll(db[COMMENTS], threadsFilter(postID, after).to_query(Comment),
+                         sort=[('createdate', -1), ('_id', -1)], limit=size + 1)
+    threads = [Comment._from_son(son) for son in sons[:size]]
+    nextCursor = encodeCursor(threads[-1]) if len(sons) > size else None
+    replies = []
+    truncated = set()
+    if threads:
+        limit = app.config['REPLIES_PER_PAGE']
+        threadIds = [t.id for t in threads]
+        sons = await findAll(db[COMMENTS], {'ancestors': {'$in': threadIds}},
+                             sort=[('createdate', 1), ('_id', 1)], limit=limit + 1)
+        replies = [Comment._from_son(son) for son in sons[:limit]]
+        if len(sons) > limit:
+            pipeline = [{'$match': {'ancestors': {'$in': threadIds}}}] + REPLY_COUNTS
+            counts = await db[COMMENTS].aggregate(pipeline).to_list(None)
+            truncated = truncatedThreads(replies, counts)
+    return threads, replies, nextCursor, truncated
+
+# Like getThreadPage() in forum.py
+async def getThreadPage(db, postID, threadID, after=None):
+    threadID = toObjectId(threadID)
+    if threadID is None:
+        abort(404)
+    limit = app.config['REPLIES_PER_PAGE']
+    # the thread and its replies are read at the same time
+    thread, sons = await asyncio.gather(
+        db[COMMENTS].find_one({'_id': threadID, 'post': postID}),
+        findAll(db[COMMENTS], threadRepliesFilter(threadID, after).to_query(Comment),
+                sort=[('createdate', 1), ('_id', 1)], limit=limit + 1),
+    )
+    if thread is None:
+        abort(404)
+    replies = [Comment._from_son(son) for son in sons[:limit]]
+    nextCursor = encodeCursor(replies[-1]) if len(sons) > limit else None
+    return [Comment._from_son(thread)], replies, nextCursor
+
+# This returns a story page with its author and its two choices (only NODE_FIELDS,
+# like the story graph has). The author and the choices are read at the same time.
+async def getStoryPage(db, pageID):
+    son = await db[PAGES].find_one({'_id': pageID})
+    if son is None:
+        return None, None, None
+    page = StoryPage._from_son(son)
+    choiceIDs = [son[name] for name in ('c1', 'c2') if son.get(name)]
+    choiceSons = []
+    if choiceIDs:
+        _, choiceSons = await asyncio.gather(
+            loadAuthors(db, [page]),
+            findAll(db[PAGES], {'_id': {'$in': choiceIDs}}, NODE_FIELDS),
+        )
+    else:
+        await loadAuthors(db, [page])
+    choices = {choice['_id']: StoryPage._from_son(choice, only_fields=NODE_FIELDS) for choice in choiceSons}
+    return page, choices.get(son.get('c1')), choices.get(son.get('c2'))
+
+# Every story page with just its title
+async def getPages(db):
+    return [StoryPage._from_son(son, only_fields=('title',)) for son in await findAll(db[PAGES], {}, ('title',))]
+
+# This returns the GridFS file (the fs.files document) of a picture or None. variant is
+# one of the names in images.VARIANTS or None for the original, which is also used if
+# the variant hasn't been made.
+async def getImageFile(db, collection, docID, variant=None):
+    docID = toObjectId(docID)
+    if docID is None:
+        return None
+    fields = ['image'] + (['image_' + variant] if variant else [])
+    doc = await db[collection].find_one({'_id': docID}, fields)
+    if doc is None:
+        return None
+    fileIDs = [doc.get(field) for field in reversed(fields) if doc.get(field)]
+    if not fileIDs:
+        return None
+    files = {f['_id']: f for f in await findAll(db[FILES], {'_id': {'$in': fileIDs}})}
+    return next((files[fileID] for fileID in fileIDs if fileID in files), None)
+
+# This gives the bytes of a GridFS file a piece at a time, so a big picture is never
+# all in memory at once.
+async def fileChunks(db, fileDoc):
+    cursor = db[CHUNKS].find({'files_id': fileDoc['_id']}, sort=[('n', 1)], batch_size=CHUNK_BATCH)
+    async for chunk in cursor:
+        yield chunk['data']
@@ -0,0 +1,65 @@
+# The async read server shares the login cookie with the Flask site. Flask keeps the
+# session (who is logged in and the flashed messages) in a signed cookie, so this
+# server reads and writes that cookie with Flask's own session code and the same
+# SECRET_KEY (set FLASK_SECRET_KEY for both servers).
+
+from flask_login.utils import decode_cookie
+from flask_login.config import COOKIE_NAME
+from werkzeug.wrappers import Response
+from app import app, login
+from app.asyncread import db
+
+# Flask's open_session() only reads request.cookies, which aiohttp requests also have
+def openSession(request):
+    if 'session' not in request:
+        request['session'] = app.session_interface.open_session(app, request)
+    return request['session']
+
+# This writes the session cookie on to response if the session was changed. Flask's
+# save_session() writes it on a werkzeug response and the header is copied from there.
+def saveSession(request, response):
+    session = request.get('session')
+    if session is None or not session.modified:
+        return
+    holder = Response()
+    app.session_interface.save_session(app, session, holder)
+    for cookie in holder.headers.getlist('Set-Cookie'):
+        response.headers.add('Set-Cookie', cookie)
+
+# Flask-Login keeps the user's id in the session, or in the 'remember me' cookie after
+# the session has ended. Flask-Login's decode_cookie() needs the app (for the secret key).
+def _rememberedUserID(request, session):
+    if session.get('_remember') == 'clear':
+        return None
+    cookie = request.cookies.get(app.config.get('REMEMBER_COOKIE_NAME', COOKIE_NAME))
+    if not cookie:
+        return None
+    with app.app_context():
+        return decode_cookie(cookie)
+
+# This returns the logged in User (like current_user) or Flask-Login's anonymous user
+async def currentUser(request):
+    if 'user' not in request:
+        session = openSession(request)
+        userID = session.get('_user_id') or _rememberedUserID(request, session)
+        user = await db.getUser(request.app['db'], userID) if userID else None
+        request['user'] = user or login.anonymous_user()
+    return request['user']
+
+# Like Flask's flash()
+def flash(request, message, category='message'):
+    session = openSession(request)
+    session['_flashes'] = session.get('_flashes', []) + [(category, message)]
+
+# Like Flask's get_flashed_messages(). The messages are taken out of the session the
+# first time it is called, so they are only shown once.
+def flashedMessages(request):
+    shown = []
+    def get_flashed_messages(with_categories=False, category_filter=()):
+        if not shown:
+            shown.append(openSession(request).pop('_flashes', []))
+        flashes = shown[0]
+        if category_filter:
+            flashes = [f for f in flashes if f[0] in category_filter]
+        return flashes if with_categories else [message for category, message in flashes]
+    return get_flashed_messages
@@ -0,0 +1,190 @@
+# The pages of the async read server. Each one does the same reads as its Flask route
+# (see db.py) and renders the same template, so the html is the same as the Flask site's.
+
+import asyncio
+import functools
+from types import SimpleNamespace
+from aiohttp import web
+from flask import render_template
+from flask_login.utils import login_url
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, parse_date
+from app import app, login
+from app.asyncread import db
+from app.asyncread.session import saveSession, currentUser, flash, flashedMessages
+from app.routes.forum import buildCommentTree
+from app.utils.dbmetrics import connectionStats
+from app.utils.images import VARIANTS
+
+routes = web.RouteTableDef()
+
+# forum.py uses abort() (for example for a bad cursor). This turns those errors in to
+# aiohttp responses.
+@web.middleware
+async def httpErrors(request, handler):
+    try:
+        return await handler(request)
+    except HTTPException as e:
+        return web.Response(status=e.code, text=e.description)
+
+# Flask's url_for needs a Flask request. This makes one for the templates from the
+# site's url rules instead.
+def urlBuilder(request):
+    adapter = app.url_map.bind(request.host, url_scheme=request.scheme)
+    def url_for(endpoint, **values):
+        anchor = values.pop('_anchor', None)
+        url = adapter.build(endpoint, values, force_external=values.pop('_external', False))
+        return url + '#' + anchor if anchor else url
+    return url_for
+
+# Like Flask's render_template(). The templates and Flask-Moment read settings from
+# current_app so the render happens inside an app context. There is no 'await' inside
+# it, so no other request can run while the context is pushed. The variables that Flask
+# would get from its request (request.args, current_user, url_for, flashed messages) are
+# passed in.
+def render(request, template, **context):
+    with app.app_context():
+        html = render_template(template,
+            request = SimpleNamespace(args=request.query),
+            current_user = request['user'],
+            url_for = urlBuilder(request),
+            get_flashed_messages = flashedMessages(request),
+            **context
+        )
+    response = web.Response(text=html, content_type='text/html')
+    # the page is different for each user
+    response.headers['Vary'] = 'Cookie'
+    saveSession(request, response)
+    # gzip or deflate if the browser asks for it
+    response.enable_compression()
+    return response
+
+# Like Flask-Login's @login_required: visitors who aren't logged in are sent to the
+# Flask site's login page with the same message and ?next= url.
+def loginRequired(handler):
+    @functools.wraps(handler)
+    async def wrapper(request):
+        user = await currentUser(request)
+        if not user.is_authenticated:
+            if login.login_message:
+                flash(request, login.login_message, login.login_message_category)
+            with app.app_context():
+                location = login_url(urlBuilder(request)(login.login_view), next_url=request.path_qs)
+            response = web.Response(status=302, headers={'Location': location})
+            saveSession(request, response)
+            return response
+        return await handler(request)
+    return wrapper
+
+def intArg(request, name):
+    try:
+        return int(request.query[name])
+    except (KeyError, ValueError):
+        return None
+
+def objectIdOr404(value):
+    docID = db.toObjectId(value)
+    if docID is None:
+        raise web.HTTPNotFound()
+    return docID
+
+@routes.get('/post/list')
+@loginRequired
+async def postList(request):
+    sort = request.query.get('sort', 'newest')
+    posts, nextCursor, prevCursor = await db.getPostPage(request.app['db'],
+        after = request.query.get('after'),
+        before = request.query.get('before'),
+        size = intArg(request, 'size'),
+        sort = sort
+    )
+    return render(request, 'posts.html', posts=posts, nextCursor=nextCursor, prevCursor=prevCursor, sort=sort)
+
+@routes.get('/post/{postID}')
+@loginRequired
+async def post(request):
+    database = request.app['db']
+    postID = objectIdOr404(request.match_info['postID'])
+    threadID = request.query.get('thread')
+    after = request.query.get('after')
+    # The post and its comments are read at the same time
+    if threadID:
+        thisPost, (comments, replies, nextCursor) = await asyncio.gather(
+            db.getPost(database, postID), db.getThreadPage(database, postID, threadID, after))
+        truncated = set()
+    else:
+        thisPost, (comments, replies, nextCursor, truncated) = await asyncio.gather(
+            db.getPost(database, postID), db.getCommentPage(database, postID, after))
+    if thisPost is None:
+        raise web.HTTPNotFound()
+    await db.loadAuthors(database, [thisPost] + comments + replies)
+    return render(request, 'post.html', post=thisPost, comments=comments, children=buildCommentTree(comments, replies),
+        threadID=threadID, nextCursor=nextCursor, truncated=truncated)
+
+@routes.get('/page/{pageID}')
+async def page(request):
+    await currentUser(request)
+    thisPage, c1, c2 = await db.getStoryPage(request.app['db'], objectIdOr404(request.match_info['pageID']))
+    if thisPage is None:
+        raise web.HTTPNotFound()
+    return render(request, 'page.html', page=thisPage, c1=c1, c2=c2)
+
+@routes.get('/pages')
+async def pages(request):
+    await currentUser(request)
+    return render(request, 'pages.html', pages=await db.getPages(request.app['db']))
+
+# Like sendGridFile() in routes/image.py. The picture is sent a piece at a time as it is
+# read from the database. Range requests aren't supported here, the whole file is sent.
+async def sendImage(request, collection, public):
+    variant = request.match_info.get('variant')
+    if variant and variant not in VARIANTS:
+        raise web.HTTPNotFound()
+    fileDoc = await db.getImageFile(request.app['db'], collection, request.match_info['docID'], variant)
+    if fileDoc is None:
+        raise web.HTTPNotFound()
+    headers = {
+        # Files in GridFS never change after they are stored so the file id is a strong etag
+        'ETag': f'"{fileDoc["_id"]}"',
+        'Cache-Control': f"{'public' if public else 'private'}, max-age={app.config['IMAGE_CACHE_TIMEOUT']}",
+    }
+    # Like werkzeug's make_conditional(): a browser that already has the file gets a 304
+    ifNoneMatch = request.headers.get('If-None-Match')
+    ifModifiedSince = parse_date(request.headers.get('If-Modified-Since'))
+    if ifNoneMatch:
+        notModified = parse_etags(ifNoneMatch).contains_weak(str(fileDoc['_id']))
+    else:
+        notModified = ifModifiedSince is not None and fileDoc['uploadDate'].replace(microsecond=0) <= ifModifiedSince
+    if notModified:
+        response = web.Response(status=304, headers=headers)
+        response.last_modified = fileDoc['uploadDate']
+        return response
+    response = web.StreamResponse(headers=headers)
+    response.last_modified = fileDoc['uploadDate']
+    response.content_type = fileDoc.get('contentType') or 'application/octet-stream'
+    response.content_length = fileDoc['length']
+    await response.prepare(request)
+    if request.method == 'HEAD':
+        return response
+    async for data in db.fileChunks(request.app['db'], fileDoc):
+        await response.write(data)
+    await response.write_eof()
+    return response
+
+@routes.get('/image/user/{docID}')
+@routes.get('/image/user/{docID}/{variant}')
+@loginRequired
+async def userImage(request):
+    return await sendImage(request, db.USERS, public=False)
+
+@routes.get('/image/page/{docID}')
+@routes.get('/image/page/{docID}/{variant}')
+async def pageImage(request):
+    return await sendImage(request, db.PAGES, public=True)
+
+# Like /metrics on the Flask site, only with the database connections of this process
+@routes.get('/metrics')
+async def metrics(request):
+    if not app.config['METRICS_ENABLED']:
+        raise web.HTTPNotFound()
+    return web.json_response({'connections': connectionStats()})
@@ -3,13 +3,12 @@
 # like IntField, StringField etc.  This uses the Mongoengine Python Library. When you interact with the 
 # data you are creating an onject that is an instance of the class.
 
-from turtle import title
 from app import app
 from flask import flash
 from flask_login import UserMixin
-from mongoengine import FileField, EmailField, StringField, ReferenceField, DateTimeField, CASCADE
+from mongoengine import FileField, EmailField, StringField, ReferenceField, DateTimeField, IntField, ListField, ObjectIdField, CASCADE, signals
 from flask_mongoengine import Document
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.passwords import hashPassword, checkPassword, needsRehash
 import datetime as dt
 import jwt
 from time import time
@@ -22,13 +21,43 @@ class User(UserMixin, Document):
     lname = StringField()
     email = EmailField()
     image = FileField()
+    # Smaller copies of image that are made when it is uploaded. See app/utils/images.py
+    image_thumb = FileField()
+    image_card = FileField()
+    image_full = FileField()
     role = StringField()
+
+    # Indexes make looking up a user by username or email fast. 'unique' means MongoDB
+    # will refuse to store two users with the same username or email.
+    # auto_create_index is turned off so that the indexes are created by the
+    # 'flask db indexes' command when the site is deployed instead of on the first request.
+    meta = {
+        'indexes': [
+            {'fields': ['username'], 'unique': True},
+            {'fields': ['email'], 'unique': True, 'sparse': True},
+            # These are used by 'flask images gc' to check if a stored file is still used
+            {'fields': ['image'], 'sparse': True},
+            {'fields': ['image_thumb'], 'sparse': True},
+            {'fields': ['image_card'], 'sparse': True},
+            {'fields': ['image_full'], 'sparse': True},
+        ],
+        'auto_create_index': False
+    }
     
+    # Hashing is done in the background by app/utils/passwords.py. Both of these raise
+    # PasswordBusy if the server is too busy hashing other passwords.
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashPassword(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return checkPassword(self.password_hash, password)
+
+    # This is called after a correct password. If the password was stored with older
+    # hash settings it is hashed again with the current ones and saved.
+    def upgrade_password(self, password):
+        if needsRehash(self.password_hash):
+            self.set_password(password)
+            User.objects(pk=self.id).update_one(set__password_hash=self.password_hash)
 
     def get_reset_password_token(self, expires_in=600):
         id=str(self.id)
@@ -49,9 +78,24 @@ class StoryPage(Document):
     title = StringField()
     content = StringField()
     image = FileField()
+    image_thumb = FileField()
+    image_card = FileField()
+    image_full = FileField()
     c1 = ReferenceField('StoryPage')
     c2 = ReferenceField('StoryPage') 
 
+    meta = {
+        'indexes': [
+            'author',
+            'title',
+            {'fields': ['image'], 'sparse': True},
+            {'fields': ['image_thumb'], 'sparse': True},
+            {'fields': ['image_card'], 'sparse': True},
+            {'fields': ['image_full'], 'sparse': True},
+        ],
+        'auto_create_index': False
+    }
+
 class Post(Document):
     author = ReferenceField('User',reverse_delete_rule=CASCADE) 
     subject = StringField()
@@ -59,21 +103,95 @@ class Post(Document):
     createdate = DateTimeField(default=dt.datetime.utcnow)
     modifydate = DateTimeField()
     review = StringField()
+    # These are copies of facts about the post's comments so that the post list doesn't
+    # have to count comments for every post. They are kept up to date by the
+    # Comment signals below and can be recalculated with 'flask posts repair-counts'.
+    commentcount = IntField(default=0)
+    lastcomment = DateTimeField()
+    # The newest of createdate and lastcomment. Used to list the most active posts first.
+    lastactivity = DateTimeField()
 
     meta = {
-        'ordering': ['-createdate']
+        'ordering': ['-createdate'],
+        # The post list is sorted by createdate (or lastactivity) then id (see getPostPage
+        # in forum.py) and 'author' is used when a user is deleted and their posts are deleted too.
+        'indexes': [
+            {'fields': ['-createdate', '-id']},
+            {'fields': ['-lastactivity', '-id']},
+            'author',
+            # A 'text' index lets MongoDB search for words in the subject and content.
+            # A word in the subject counts 5 times as much as one in the content.
+            {'fields': ['$subject', '$content'], 'default_language': 'english', 'weights': {'subject': 5, 'content': 1}},
+        ],
+        'auto_create_index': False
     }
 
 class Comment(Document):
     author = ReferenceField('User',reverse_delete_rule=CASCADE) 
     post = ReferenceField('Post',reverse_delete_rule=CASCADE)
-    # This could be used to allow comments on comments
-    # comment = ReferenceField('Comment',reverse_delete_rule=CASCADE)
+    # These allow comments on comments (replies). parent is the comment this one replies
+    # to (None for a comment on the post itself). ancestors is the list of ids from the
+    # top comment of the thread down to the parent, so a whole thread can be found with
+    # one query: Comment.objects(ancestors=topCommentID). depth is len(ancestors).
+    parent = ReferenceField('self')
+    ancestors = ListField(ObjectIdField())
+    depth = IntField(default=0)
     content = StringField()
     createdate = DateTimeField(default=dt.datetime.utcnow)
     modifydate = DateTimeField()
 
     meta = {
-        'ordering': ['-createdate']
+        'ordering': ['-createdate'],
+        # The post page gets all of the comments for one post, newest first.
+        'indexes': [
+            {'fields': ['post', '-createdate']},
+            {'fields': ['post', 'parent', '-createdate', '-id']},
+            'ancestors',
+            'author',
+            {'fields': ['$content'], 'default_language': 'english'},
+        ],
+        'auto_create_index': False
     }
 
+# mongoengine sends a 'signal' after a document is saved or deleted. These functions
+# listen for the Comment signals and update the counts on the comment's Post with a
+# single atomic update, so two people commenting at once can't lose a count.  Because
+# they are signals they also run when comments are deleted because their author or
+# post was deleted (reverse_delete_rule=CASCADE).
+def commentSaved(sender, document, created=False, **kwargs):
+    if not created:
+        return
+    Post.objects(id=document._data['post'].id).update_one(
+        inc__commentcount=1,
+        max__lastcomment=document.createdate,
+        max__lastactivity=document.createdate
+    )
+
+def commentDeleted(sender, document, **kwargs):
+    postID = document._data['post'].id
+    # modify() changes the post and returns it as it was, in one atomic step
+    post = Post.objects(id=postID).only('createdate', 'lastcomment').modify(dec__commentcount=1)
+    # MongoDB keeps dates to the millisecond
+    deleted = document.createdate.replace(microsecond=document.createdate.microsecond // 1000 * 1000)
+    if post is None or post.lastcomment != deleted:
+        # the post is gone, or this wasn't its newest comment so the dates don't change
+        return
+    # the newest comment that is left (uses the post + createdate index)
+    newest = Comment.objects(post=postID).only('createdate').order_by('-createdate').first()
+    if newest:
+        update = dict(set__lastcomment=newest.createdate, set__lastactivity=max(post.createdate, newest.createdate))
+    else:
+        update = dict(unset__lastcomment=True, set__lastactivity=post.createdate)
+    # Only if lastcomment is still the deleted comment's date. If someone commented in
+    # the meantime commentSaved() already moved it forward and that must not be undone.
+    Post.objects(id=postID, lastcomment=deleted).update_one(**update)
+
+# When a post is deleted its comments are deleted too (reverse_delete_rule=CASCADE), and
+# mongoengine would delete them one at a time so that commentDeleted() can update a post
+# that is going away anyway. This deletes them first with one command instead.
+def postDeleting(sender, document, **kwargs):
+    Comment._get_collection().delete_many({'post': document.id})
+
+signals.post_save.connect(commentSaved, sender=Comment)
+signals.post_delete.connect(commentDeleted, sender=Comment)
+signals.pre_delete.connect(postDeleting, sender=Post)
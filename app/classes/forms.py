@@ -2,7 +2,6 @@
 # and users fill them out.  Each form is an instance of of a class. Forms are managed by the 
 # Flask-WTForms library.
 
-from tkinter.tix import Select
 from flask.app import Flask
 from flask import flash
 from flask_wtf import FlaskForm
@@ -11,7 +10,9 @@ import mongoengine.errors
 #from wtforms.fields.html5 import URLField, DateField, DateTimeField, EmailField
 from wtforms.validators import URL, NumberRange, Email, Optional, InputRequired, ValidationError, DataRequired, EqualTo
 from wtforms import PasswordField, StringField, SubmitField, validators, TextAreaField, HiddenField, IntegerField, SelectField, FileField, BooleanField
-from app.classes.data import User
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from app.classes.data import StoryPage
 
 class LoginForm(FlaskForm):
     username = StringField('username', validators=[DataRequired()])
@@ -28,22 +29,6 @@ class RegistrationForm(FlaskForm):
     password2 = PasswordField('repeat password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('register')
 
-    def validate_username(self, username):
-        try:
-            User.objects.get(username=username.data)
-        except mongoengine.errors.DoesNotExist:
-            flash(f"{username.data} is available.")
-        else:
-            raise ValidationError('this username is taken.')
-
-    def validate_email(self, email):
-        try:
-            User.objects.get(email=email.data)
-        except mongoengine.errors.DoesNotExist:
-            flash(f'{email.data} is a unique email address.')
-        else:
-            raise ValidationError('this email address is already in use. if you have forgotten your credentials you can try to recover your account.')
-
 class ResetPasswordRequestForm(FlaskForm):
     email = StringField('email', validators=[DataRequired(), Email()])
     submit = SubmitField('request password reset')
@@ -60,12 +45,22 @@ class ProfileForm(FlaskForm):
     image = FileField("image") 
     submit = SubmitField('post')
 
+# The c1/c2 dropdowns are filled in by the page search so any value can be sent back.
+# This makes sure it is empty ('no choice') or the id of a page that exists.
+def storyPageExists(form, field):
+    if not field.data:
+        return
+    try:
+        StoryPage.objects.only('id').get(id=ObjectId(field.data))
+    except (InvalidId, TypeError, mongoengine.errors.DoesNotExist):
+        raise ValidationError('That page does not exist. Search for it again.')
+
 class StoryPageForm(FlaskForm):
     title = StringField('Title')
     content = TextAreaField('Content')
     image = FileField('Image')
-    c1 = SelectField("Choice 1", choices=[], validate_choice=False)
-    c2 = SelectField("Choice 2", choices=[], validate_choice=False)
+    c1 = SelectField("Choice 1", choices=[], validate_choice=False, validators=[storyPageExists])
+    c2 = SelectField("Choice 2", choices=[], validate_choice=False, validators=[storyPageExists])
     submit = SubmitField('submit')
 
 class PostForm(FlaskForm):
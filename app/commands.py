@@ -0,0 +1,384 @@
+# These are commands that are run from the terminal instead of from a web page.
+# They are used for maintenance jobs like fixing up data that is already stored.
+# To see the list of commands, set FLASK_APP=main.py in the terminal and then type:
+#     flask --help
+
+import click
+import csv
+import gzip
+import json
+import os
+from bson import json_util
+from pymongo.errors import BulkWriteError
+import mongoengine.errors
+from mongoengine.connection import get_db
+from app import app
+from bson.objectid import ObjectId
+from mongoengine.queryset.visitor import Q
+from app.classes.data import User, StoryPage, Post, Comment
+from app.utils.images import backfillImage
+from app.utils.storygraph import getStoryGraph
+from app.utils.postcounts import repairPostCounts
+from app.utils.gridfsgc import sweep
+from app.utils.assets import buildAssets
+from app.utils.passwords import hashPasswords
+from app.utils.users import insertUsers, missingUniqueIndexes, UNIQUE_FIELDS
+
+images = click.Group('images', help='Commands for uploaded images.')
+app.cli.add_command(images)
+
+# flask images backfill
+# This makes the thumb/card/full copies for images that were uploaded before those
+# copies were made automatically.
+@images.command('backfill')
+@click.option('--batch-size', default=100, show_default=True, help='Documents fetched per database round-trip.')
+def imagesBackfill(batch_size):
+    for docClass in (User, StoryPage):
+        # only documents that have an image but no thumbnail yet
+        docs = docClass.objects(image__ne=None, image_thumb=None).batch_size(batch_size).no_cache()
+        done = failed = 0
+        for doc in docs:
+            try:
+                backfillImage(doc)
+            except ValueError:
+                click.echo(f'{docClass.__name__} {doc.id}: stored image could not be read, skipped')
+                failed += 1
+            else:
+                done += 1
+        click.echo(f'{docClass.__name__}: {done} backfilled, {failed} skipped')
+
+# flask images gc
+# This finds stored files that nothing points to anymore. Without --delete it only
+# reports how much space could be freed.
+@images.command('gc')
+@click.option('--delete', is_flag=True, help='Delete the files instead of only reporting them.')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--max-batches', type=int, help='Stop after this many batches. The next run carries on from there.')
+@click.option('--grace-hours', default=24, show_default=True, help='Never delete files newer than this.')
+@click.option('--restart', is_flag=True, help='Start from the first file instead of where the last run stopped.')
+def imagesGC(delete, batch_size, max_batches, grace_hours, restart):
+    report = sweep(batch_size, max_batches, grace_hours, dryRun=not delete, restart=restart)
+    click.echo(f"checked {report['checked']} files, {report['orphans']} not used "
+               f"({report['bytes'] / (1024 * 1024):.1f} MB), {report['deleted']} deleted")
+    if not report['finished']:
+        click.echo('stopped before the last file, run again to continue')
+
+db = click.Group('db', help='Commands for the MongoDB database.')
+app.cli.add_command(db)
+
+# All of the collections that have indexes declared in their meta in data.py
+DOCUMENTS = (User, StoryPage, Post, Comment)
+
+# flask db indexes
+# This creates the indexes declared in data.py and reports any index that is in the
+# database but not in data.py (or the other way around). Run this when the site is deployed.
+@db.command('indexes')
+def dbIndexes():
+    for docClass in DOCUMENTS:
+        docClass.ensure_indexes()
+        diff = docClass.compare_indexes()
+        name = docClass._get_collection_name()
+        for spec in diff['missing']:
+            click.echo(f'{name}: missing index {spec}')
+        for spec in diff['extra']:
+            click.echo(f'{name}: index {spec} is not declared in data.py')
+        if not diff['missing']:
+            click.echo(f'{name}: indexes ok')
+
+# These are the queries that run on almost every page. They are used by 'flask db explain'
+# to make sure MongoDB can answer each one with an index.
+# The post list and comment queries come from forum.py so the same queries that the
+# pages send are checked, including the ones for the next page of a list ('after' a cursor).
+def hotQueries():
+    from app.routes.forum import postsQuery, threadsQuery, repliesQuery, threadRepliesQuery
+    cursor = f'1600000000000-{ObjectId()}'
+    return {
+        'login': User.objects(username='explain'),
+        'reset_password_request': User.objects(email='explain@example.com'),
+        'postList': postsQuery('createdate').limit(25),
+        'postList after': postsQuery('createdate', cursor).limit(25),
+        'postList active after': postsQuery('lastactivity', cursor).limit(25),
+        'postList active after undated': postsQuery('lastactivity', f'-{ObjectId()}').limit(25),
+        'post comments': threadsQuery(ObjectId()).limit(10),
+        'post comments after': threadsQuery(ObjectId(), cursor).limit(10),
+        'comment replies': repliesQuery([ObjectId(), ObjectId()]).limit(50),
+        'comment thread after': threadRepliesQuery(ObjectId(), cursor).limit(50),
+    }
+
+# This looks through an explain() plan for a stage that reads the whole collection
+def hasCollectionScan(plan):
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(hasCollectionScan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(hasCollectionScan(value) for value in plan)
+    return False
+
+# flask db explain
+# This asks MongoDB how it would run each of the hot queries and fails if any of them
+# would have to scan the whole collection (a COLLSCAN).
+@db.command('explain')
+def dbExplain():
+    failed = []
+    for name, queryset in hotQueries().items():
+        plan = queryset.explain()
+        if hasCollectionScan(plan.get('queryPlanner', plan)):
+            failed.append(name)
+            click.echo(f'{name}: COLLSCAN')
+        else:
+            click.echo(f'{name}: uses an index')
+    if failed:
+        raise click.ClickException('Queries without an index: ' + ', '.join(failed))
+
+story = click.Group('story', help='Commands for the story game.')
+app.cli.add_command(story)
+
+# flask story report
+# This lists the pages that can't be reached from any start page and the choices that
+# point to pages that were deleted.
+@story.command('report')
+def storyReport():
+    report = getStoryGraph().report()
+    click.echo(f"{report['pages']} pages, {report['reachable']} reachable from a start page")
+    for name, pageID in report['startPages'].items():
+        click.echo(f'start page {name}: {pageID}')
+    for pageID in report['unreachable']:
+        click.echo(f'unreachable: {pageID}')
+    for pageID, choice, missingID in report['dangling']:
+        click.echo(f'dangling: {pageID} {choice} -> {missingID}')
+
+data = click.Group('data', help='Commands to back up and restore the site data.')
+app.cli.add_command(data)
+
+# The collections that are exported, in the order they are imported. GridFS keeps each
+# uploaded file in fs.files and its pieces in fs.chunks.
+def dataCollections():
+    db = get_db()
+    return [
+        ('fs.files', db['fs.files']),
+        ('fs.chunks', db['fs.chunks']),
+        ('user', User._get_collection()),
+        ('story_page', StoryPage._get_collection()),
+        ('post', Post._get_collection()),
+        ('comment', Comment._get_collection()),
+    ]
+
+def _openFile(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+# flask data export <folder>
+# This writes every collection to <folder>/<collection>.ndjson with one document per line.
+# Documents keep their ids so the references between them still work after an import.
+# Documents are read with a cursor batch_size at a time, so memory use stays the same
+# no matter how big the collections are.
+@data.command('export')
+@click.argument('folder')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--gzip/--no-gzip', 'compress', default=True, show_default=True, help='Compress the files.')
+def dataExport(folder, batch_size, compress):
+    os.makedirs(folder, exist_ok=True)
+    for name, collection in dataCollections():
+        path = os.path.join(folder, name + '.ndjson' + ('.gz' if compress else ''))
+        count = 0
+        with _openFile(path, 'w') as f:
+            for doc in collection.find().sort('_id', 1).batch_size(batch_size):
+                f.write(json_util.dumps(doc, json_options=json_util.CANONICAL_JSON_OPTIONS) + '\n')
+                count += 1
+        click.echo(f'{name}: {count} documents -> {path}')
+
+def _insertBatch(collection, batch):
+    try:
+        collection.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        errors = [err for err in e.details['writeErrors'] if err['code'] != 11000]
+        if errors:
+            raise click.ClickException(f'{collection.name}: {errors[0]["errmsg"]}')
+        # 11000 is a duplicate key. When an import is resumed that is a document with the
+        # same _id that is already there, which is fine. It can also be another unique
+        # field (like a username) that a different document already has, which would
+        # leave out the document and break everything that refers to it.
+        duplicateIDs = [err['op']['_id'] for err in e.details['writeErrors']]
+        found = {doc['_id'] for doc in collection.find({'_id': {'$in': duplicateIDs}}, {'_id': 1})}
+        conflicts = [docID for docID in duplicateIDs if docID not in found]
+        if conflicts:
+            raise click.ClickException(
+                f'{collection.name}: {len(conflicts)} documents clash with a different document '
+                f'on a unique field (like a username or email), first _id: {conflicts[0]}. '
+                'Fix or remove the clashing documents and run the import again.')
+
+# flask data import <folder>
+# This reads the files written by 'flask data export' and inserts the documents in
+# batches. The line reached in each file is saved in <folder>/import-progress.json after
+# every batch, so if an import stops it can be run again and carries on from there.
+@data.command('import')
+@click.argument('folder')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--restart', is_flag=True, help='Ignore saved progress and start from the beginning.')
+def dataImport(folder, batch_size, restart):
+    progressPath = os.path.join(folder, 'import-progress.json')
+    progress = {}
+    if os.path.exists(progressPath) and not restart:
+        with open(progressPath) as f:
+            progress = json.load(f)
+
+    def saveProgress():
+        with open(progressPath + '.tmp', 'w') as f:
+            json.dump(progress, f)
+        os.replace(progressPath + '.tmp', progressPath)
+
+    # The file of each collection, or None if it wasn't exported
+    paths = {}
+    for name, collection in dataCollections():
+        path = os.path.join(folder, name + '.ndjson')
+        if not os.path.exists(path):
+            path += '.gz'
+        paths[name] = path if os.path.exists(path) else None
+    if not any(paths.values()):
+        raise click.ClickException(f'No exported files in {folder}')
+
+    for name, collection in dataCollections():
+        path = paths[name]
+        if not path:
+            click.echo(f'{name}: no file, skipped')
+            continue
+        done = progress.get(name, 0)
+        batch = []
+        line = 0
+        with _openFile(path, 'r') as f:
+            for line, text in enumerate(f, start=1):
+                if line <= done:
+                    continue
+                batch.append(json_util.loads(text))
+                if len(batch) >= batch_size:
+                    _insertBatch(collection, batch)
+                    batch = []
+                    progress[name] = line
+                    saveProgress()
+            if batch:
+                _insertBatch(collection, batch)
+            progress[name] = line
+            saveProgress()
+        click.echo(f'{name}: {line - done} documents imported')
+    os.remove(progressPath)
+
+posts = click.Group('posts', help='Commands for journal posts.')
+app.cli.add_command(posts)
+
+# flask posts repair-counts
+# This recalculates the comment count and last activity of every post
+@posts.command('repair-counts')
+@click.option('--batch-size', default=1000, show_default=True)
+def postsRepairCounts(batch_size):
+    click.echo(f'{repairPostCounts(batch_size)} posts updated')
+
+assets = click.Group('assets', help='Commands for the files in app/static.')
+app.cli.add_command(assets)
+
+# flask assets build
+# This makes the fingerprinted, compressed copies of the static files in app/static/dist.
+# Run it every time a static file changes, before starting the web server.
+@assets.command('build')
+@click.option('--clean', is_flag=True, help='Delete built files that are no longer used.')
+def assetsBuild(clean):
+    before = after = 0
+    for name, built, original, output, copies in buildAssets(clean):
+        before += original
+        after += output
+        extra = ' '.join(suffix.lstrip('.') for suffix in copies)
+        click.echo(f'{name} -> {built} ({original // 1024} KB -> {output // 1024} KB) {extra}'.rstrip())
+    click.echo(f'total {before / (1024 * 1024):.1f} MB -> {after / (1024 * 1024):.1f} MB')
+
+users = click.Group('users', help='Commands for user accounts.')
+app.cli.add_command(users)
+
+# The columns 'flask users import' reads. Only username is required. Users without a
+# password can set one with 'forgot password'.
+USER_COLUMNS = ('username', 'email', 'fname', 'lname', 'role', 'password')
+
+def _importBatch(rows, workers):
+    # rows is a list of (line number, row). Hashing is the slow part, so first every row
+    # that can't be inserted is left out: rows that aren't valid, that repeat a username
+    # or email from earlier in the batch, or whose username or email is already taken
+    # (one query for the whole batch).
+    newUsers = []
+    lines = []
+    problems = []
+    seen = {field: set() for field in UNIQUE_FIELDS}
+    for line, row in rows:
+        user = User(**{name: row.get(name) or None for name in USER_COLUMNS if name != 'password'})
+        try:
+            user.validate()
+        except mongoengine.errors.ValidationError as e:
+            problems.append(f'line {line}: {e}')
+            continue
+        repeated = [field for field in UNIQUE_FIELDS if user[field] and user[field] in seen[field]]
+        if repeated:
+            problems.append(f'line {line}: {repeated[0]} is already used earlier in the file')
+            continue
+        for field in UNIQUE_FIELDS:
+            if user[field]:
+                seen[field].add(user[field])
+        newUsers.append((line, row, user))
+
+    taken = User.objects(Q(username__in=list(seen['username'])) | Q(email__in=list(seen['email']))).only(*UNIQUE_FIELDS)
+    takenValues = {field: {doc[field] for doc in taken} for field in UNIQUE_FIELDS}
+    passwords = []
+    users = []
+    for line, row, user in newUsers:
+        field = next((field for field in UNIQUE_FIELDS if user[field] and user[field] in takenValues[field]), None)
+        if field:
+            problems.append(f'line {line}: {field} is already taken')
+            continue
+        if row.get('password'):
+            passwords.append((user, row['password']))
+        users.append(user)
+        lines.append(line)
+
+    # the hashing is done for the rest of the batch at once on several threads
+    for (user, password), pwhash in zip(passwords, hashPasswords([p for u, p in passwords], workers)):
+        user.password_hash = pwhash
+    # the unique indexes still catch a user that was created since the query above
+    inserted, skipped = insertUsers(users)
+    problems += [f'line {lines[i]}: {field or "username or email"} is already taken' for i, field in skipped]
+    return inserted, problems
+
+# flask users import <file.csv>
+# This creates many users at once from a csv file whose first line names the columns,
+# for example:  username,email,fname,lname,role,password
+# Users are inserted batch-size at a time with one round-trip per batch. Rows whose
+# username or email is already taken are reported and skipped.
+@users.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--workers', type=int, help='Threads used to hash passwords. Default is one per CPU.')
+def usersImport(path, batch_size, workers):
+    if missingUniqueIndexes():
+        raise click.ClickException("The user indexes don't exist yet so duplicate users can't be found. Run 'flask db indexes' first.")
+    total = 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if 'username' not in (reader.fieldnames or []):
+            raise click.ClickException('The first line of the file must name the columns and include username.')
+        batch = []
+        # line 1 is the column names
+        for line, row in enumerate(reader, start=2):
+            row = {name.strip().lower(): (value or '').strip() for name, value in row.items() if name}
+            if not row.get('username'):
+                click.echo(f'line {line}: no username, skipped')
+                continue
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                inserted, problems = _importBatch(batch, workers)
+                total += inserted
+                for problem in problems:
+                    click.echo(problem)
+                batch = []
+        if batch:
+            inserted, problems = _importBatch(batch, workers)
+            total += inserted
+            for problem in problems:
+                click.echo(problem)
+    click.echo(f'{total} users created')
@@ -4,4 +4,8 @@ from .forum import *
 from .mail import *
 from .user import *
 from .quiz import * 
-from .story import *
\ No newline at end of file
+from .story import *
+from .image import *
+from .metrics import *
+from .health import *
+from .assets import *
\ No newline at end of file
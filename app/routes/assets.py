@@ -0,0 +1,36 @@
+# This route sends the fingerprinted copies of the static files that are made by
+# 'flask assets build' (see app/utils/assets.py).  The name of each file changes when
+# its contents change, so the browser is told it can keep it for a year without ever
+# checking again ('immutable').  If the browser accepts brotli or gzip and a
+# precompressed copy was built, that copy is sent instead.
+
+import mimetypes
+import os
+from app import app
+from flask import request, abort, send_file
+from werkzeug.security import safe_join
+
+app.config.setdefault('ASSET_CACHE_TIMEOUT', 60 * 60 * 24 * 365)
+
+# The order here is the order they are tried in. brotli files are smaller.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    path = safe_join(app.config['ASSET_DIR'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in request.accept_encodings and os.path.isfile(path + suffix):
+            path += suffix
+            encoding = name
+            break
+    rv = send_file(path, mimetype=mimetype, conditional=True, cache_timeout=app.config['ASSET_CACHE_TIMEOUT'])
+    if encoding:
+        rv.headers['Content-Encoding'] = encoding
+    # caches in between have to keep the compressed and uncompressed copies apart
+    rv.vary.add('Accept-Encoding')
+    rv.headers['Cache-Control'] = f"public, max-age={app.config['ASSET_CACHE_TIMEOUT']}, immutable"
+    return rv
@@ -1,51 +1,54 @@
 from app import app
-from flask import render_template
+from app.utils.pagecache import renderStatic
+
+# These pages don't change so renderStatic() sends a copy that was rendered earlier.
+# See app/utils/pagecache.py
 
 # This is for rendering the home page
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return renderStatic('index.html')
 
 @app.route('/aboutus')
 def aboutus():
-    return render_template('aboutus.html')
+    return renderStatic('aboutus.html')
 
 @app.route('/posts')
 def posts():
-    return render_template('posts.html')
+    return renderStatic('posts.html')
 
 @app.route('/game')
 def game():
-    return render_template('game.html')
+    return renderStatic('game.html')
 
 @app.route('/aboutsite')
 def aboutsite():
-    return render_template('aboutsite.html')
+    return renderStatic('aboutsite.html')
 
 
 @app.route('/mentalhealth')
 def mentalhealth():
-    return render_template('mentalhealth.html')
+    return renderStatic('mentalhealth.html')
 
     
 @app.route('/surveypage')
 def surveypage():
-    return render_template('surveypage.html')
+    return renderStatic('surveypage.html')
 
 
 @app.route('/reflection')
 def reflection():
-    return render_template('reflection.html')
+    return renderStatic('reflection.html')
 
 
 @app.route('/result')
 def result():
-    return render_template('result.html')
+    return renderStatic('result.html')
 
     
 @app.route('/result2')
 def result2():
-    return render_template('result2.html')
+    return renderStatic('result2.html')
 
 
 
@@ -4,25 +4,286 @@
 
 from app import app, login
 import mongoengine.errors
-from flask import render_template, flash, redirect, url_for
+from flask import render_template, flash, redirect, url_for, request, abort
 from flask_login import current_user
-from app.classes.data import Post, Comment
+from mongoengine.queryset.visitor import Q
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from bson.dbref import DBRef
+from app.classes.data import Post, Comment, User
 from app.classes.forms import PostForm, CommentForm
 from flask_login import login_required
 import datetime as dt
 
-# This is the route to list all posts
+# The number of posts shown on each page of the post list.  This can be changed with
+# app.config['POSTS_PER_PAGE'] or per request with ?size=
+app.config.setdefault('POSTS_PER_PAGE', 25)
+MAX_POSTS_PER_PAGE = 100
+EPOCH = dt.datetime(1970, 1, 1)
+
+# The post list is split in to pages using a 'cursor'.  A cursor is a short string that
+# remembers the date and id of the last post on a page so the next page can start
+# right after it. This is faster than skipping posts because MongoDB never has to count
+# past the posts that were already shown, and pages don't shift when new posts are added.
+# The date is createdate for the newest posts or lastactivity for the most active posts.
+SORT_FIELDS = {'newest': 'createdate', 'active': 'lastactivity'}
+
+#
+# Posts from before lastactivity was added have no lastactivity until 'flask posts
+# repair-counts' is run. MongoDB sorts a missing date below every real date, so those
+# posts come last in the 'active' list and their cursor has no date: "-<id>".
+def encodeCursor(post, field='createdate'):
+    if post[field] is None:
+        return f"-{post.id}"
+    ms = (post[field] - EPOCH) // dt.timedelta(milliseconds=1)
+    return f"{ms}-{post.id}"
+
+# This returns (date, id) where date is None for a cursor without a date
+def decodeCursor(cursor):
+    try:
+        ms, postID = cursor.split('-')
+        return EPOCH + dt.timedelta(milliseconds=int(ms)) if ms else None, ObjectId(postID)
+    except (ValueError, InvalidId):
+        abort(400)
+
+# The query for the posts before (older=True) or after a cursor in the sort order
+def cursorQuery(cursor, field, older=True):
+    date, postID = decodeCursor(cursor)
+    if date is None:
+        if older:
+            return Q(**{field: None, 'id__lt': postID})
+        return Q(**{field: None, 'id__gt': postID}) | Q(**{field + '__ne': None})
+    if older:
+        # the posts without a date come after every dated post
+        return Q(**{field + '__lt': date}) | Q(**{field: date, 'id__lt': postID}) | Q(**{field: None})
+    return Q(**{field + '__gt': date}) | Q(**{field: date, 'id__gt': postID})
+
+# The posts after a cursor (all of them without one), in the order of the post list.
+# 'flask db explain' (commands.py) checks that this query uses an index.
+def postsQuery(field, after=None):
+    query = cursorQuery(after, field) if after else Q()
+    return Post.objects(query).order_by('-' + field, '-id')
+
+# This is a helper function that gets one page of posts, newest first.  'after' is the
+# cursor of the post above the page (go to older posts) and 'before' is the cursor of
+# the post below the page (go back to newer posts). sort is one of SORT_FIELDS. It
+# returns the posts and the cursors for the next and previous pages (None if there isn't one).
+def getPostPage(after=None, before=None, size=None, sort='newest'):
+    field = SORT_FIELDS.get(sort, 'createdate')
+    size = min(max(size or app.config['POSTS_PER_PAGE'], 1), MAX_POSTS_PER_PAGE)
+    if before:
+        posts = list(Post.objects(cursorQuery(before, field, older=False)).order_by('+' + field, '+id').limit(size + 1))
+        hasMore = len(posts) > size
+        posts = posts[:size]
+        posts.reverse()
+        loadAuthors(posts)
+        if posts:
+            return posts, encodeCursor(posts[-1], field), encodeCursor(posts[0], field) if hasMore else None
+        # Everything newer was deleted so just show the first page
+        after = None
+
+    posts = list(postsQuery(field, after).limit(size + 1))
+    hasMore = len(posts) > size
+    posts = posts[:size]
+    loadAuthors(posts)
+    nextCursor = encodeCursor(posts[-1], field) if hasMore else None
+    prevCursor = encodeCursor(posts[0], field) if after and posts else None
+    return posts, nextCursor, prevCursor
+
+# These are the only User fields that the post and comment templates use.
+AUTHOR_FIELDS = ('username', 'image', 'image_thumb')
+
+# Each post and comment stores a reference to its author.  If the template asks for
+# post.author.username, mongoengine goes to the database once for EVERY row to get that
+# author. This helper function gets all of the authors for a list of posts or comments
+# with one query instead and puts them on the rows so the template doesn't have to.
+def loadAuthors(docs):
+    # _data holds the raw reference (a DBRef) so reading it doesn't go to the database
+    refs = [doc._data.get('author') for doc in docs]
+    ids = {ref.id for ref in refs if isinstance(ref, DBRef)}
+    if not ids:
+        return docs
+    authors = {user.id: user for user in User.objects(id__in=list(ids)).only(*AUTHOR_FIELDS)}
+    for doc, ref in zip(docs, refs):
+        if isinstance(ref, DBRef) and ref.id in authors:
+            doc._data['author'] = authors[ref.id]
+    return docs
+
+# This is the route to list the posts
 @app.route('/post/list')
 # This means the user must be logged in to see this page
 @login_required
 def postList():
-    # This retrieves all of the 'posts' that are stored in MongoDB and places them in a
-    # mongoengine object as a list of dictionaries name 'posts'.
-    posts = Post.objects()
+    # This retrieves one page of the 'posts' that are stored in MongoDB. The cursors
+    # from the url say which page.
+    posts, nextCursor, prevCursor = getPostPage(
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        size=request.args.get('size', type=int),
+        # ?sort=active lists the posts with the newest comments first
+        sort=request.args.get('sort', 'newest')
+    )
     # This renders (shows to the user) the posts.html template. it also sends the posts object 
     # to the template as a variable named posts.  The template uses a for loop to display
-    # each post.
-    return render_template('posts.html',posts=posts)
+    # each post.  The cursors are used to make the 'older' and 'newer' links.
+    return render_template('posts.html',posts=posts,nextCursor=nextCursor,prevCursor=prevCursor,sort=request.args.get('sort', 'newest'))
+
+# Search finds at most this many matching posts and then shows them SEARCH_PER_PAGE at a time.
+app.config.setdefault('SEARCH_MAX_RESULTS', 200)
+app.config.setdefault('SEARCH_PER_PAGE', 20)
+# A post that matches because of one of its comments is ranked a bit lower than a
+# post that matches itself.
+COMMENT_SCORE_WEIGHT = 0.5
+SEARCH_POST_FIELDS = ('subject', 'author', 'createdate', 'review')
+
+# This is a helper function that searches posts and comments for the words in 'words'
+# using the text indexes in data.py. It returns a list of (score, post) with the best
+# matches first. author is an optional User to only search their posts and comments.
+def searchPosts(words, author=None):
+    limit = app.config['SEARCH_MAX_RESULTS']
+    filters = {'author': author} if author else {}
+    scores = {}
+    posts = {}
+    for post in Post.objects(**filters).search_text(words).order_by('$text_score').only(*SEARCH_POST_FIELDS).limit(limit):
+        scores[post.id] = post.get_text_score()
+        posts[post.id] = post
+    for comment in Comment.objects(**filters).search_text(words).order_by('$text_score').only('post').limit(limit):
+        postID = comment._data['post'].id
+        scores[postID] = max(scores.get(postID, 0), comment.get_text_score() * COMMENT_SCORE_WEIGHT)
+    # get the posts that only matched because of a comment in one query
+    missing = [postID for postID in scores if postID not in posts]
+    if missing:
+        for post in Post.objects(id__in=missing).only(*SEARCH_POST_FIELDS):
+            posts[post.id] = post
+    results = sorted(((scores[postID], post) for postID, post in posts.items()), key=lambda r: r[0], reverse=True)
+    return results[:limit]
+
+# This is the route for searching posts and comments. For example:
+# /post/search?q=sleep&author=sophie&page=2
+@app.route('/post/search')
+@login_required
+def postSearch():
+    words = request.args.get('q', '').strip()
+    username = request.args.get('author', '').strip()
+    pageNum = max(request.args.get('page', 1, type=int), 1)
+    perPage = app.config['SEARCH_PER_PAGE']
+    results = []
+    author = None
+    if username:
+        author = User.objects(username=username).only('id').first()
+        if not author:
+            flash(f"There is no user named {username}.")
+    if words and (author or not username):
+        results = searchPosts(words, author)
+    pageResults = results[(pageNum - 1) * perPage:pageNum * perPage]
+    loadAuthors([post for score, post in pageResults])
+    return render_template('search.html', results=pageResults, words=words, username=username,
+        pageNum=pageNum, hasMore=len(results) > pageNum * perPage, total=len(results))
+
+# Comments can be replies to other comments, up to MAX_COMMENT_DEPTH levels deep. A reply to
+# a comment that is already that deep is added next to it instead of under it.
+MAX_COMMENT_DEPTH = 5
+# The post page shows this many top comments ('threads') at a time, with their replies.
+app.config.setdefault('THREADS_PER_PAGE', 20)
+# The most replies shown on one page. Very big threads are continued on their own page.
+app.config.setdefault('REPLIES_PER_PAGE', 500)
+
+# This is a helper function that puts replies under the comment they reply to. It goes
+# through the replies once, so it takes the same time per reply however deep the thread is.
+# replies must be oldest first so that every list of replies ends up oldest first.
+# It returns {commentId: [replies]}.
+def buildCommentTree(threads, replies):
+    present = {comment.id for comment in threads}
+    present.update(comment.id for comment in replies)
+    children = {}
+    for reply in replies:
+        # normally the parent is ancestors[-1]. If that comment was deleted or isn't on
+        # this page, the reply goes under the closest ancestor that is.
+        parentID = next((a for a in reversed(reply.ancestors) if a in present), None)
+        if parentID is not None:
+            children.setdefault(parentID, []).append(reply)
+    return children
+
+# These are the queries for the comments on the post page. 'flask db explain'
+# (commands.py) checks that each one uses an index.
+
+# The filters are separate from the queries so that the async read server
+# (app/asyncread) can send the same ones with its own database driver.
+
+# The top comments ('threads') of a post, newest first, after the cursor 'after'
+def threadsFilter(postID, after=None):
+    query = Q(post=postID, parent=None)
+    if after:
+        date, commentID = decodeCursor(after)
+        query &= Q(createdate__lt=date) | Q(createdate=date, id__lt=commentID)
+    return query
+
+def threadsQuery(postID, after=None):
+    return Comment.objects(threadsFilter(postID, after)).order_by('-createdate', '-id')
+
+# Every reply in the threads threadIds, oldest first
+def repliesQuery(threadIds):
+    return Comment.objects(ancestors__in=threadIds).order_by('createdate', 'id')
+
+# The replies in one thread, oldest first, after the cursor 'after'
+def threadRepliesFilter(threadID, after=None):
+    query = Q(ancestors=threadID)
+    if after:
+        date, commentID = decodeCursor(after)
+        query &= Q(createdate__gt=date) | Q(createdate=date, id__gt=commentID)
+    return query
+
+def threadRepliesQuery(threadID, after=None):
+    return Comment.objects(threadRepliesFilter(threadID, after)).order_by('createdate', 'id')
+
+# This is a helper function that gets one page of comments for a post with all of their
+# replies using two queries: one for the threads and one for every reply in those threads.
+# after is the cursor of the last thread on the previous page. It also returns the set
+# of thread ids that have more replies than were shown ('truncated').
+def getCommentPage(post, after=None):
+    size = app.config['THREADS_PER_PAGE']
+    threads = list(threadsQuery(post.id, after).limit(size + 1))
+    nextCursor = encodeCursor(threads[size - 1]) if len(threads) > size else None
+    threads = threads[:size]
+    replies = []
+    truncated = set()
+    if threads:
+        limit = app.config['REPLIES_PER_PAGE']
+        replies = list(repliesQuery([t.id for t in threads]).limit(limit + 1))
+        if len(replies) > limit:
+            replies = replies[:limit]
+            truncated = cutThreads(threads, replies)
+    return threads, replies, nextCursor, truncated
+
+# Only REPLIES_PER_PAGE replies are shown for all of the threads on a page together, so
+# some threads are cut off and others are complete. This counts the replies in each
+# thread with one query (ancestors[0] is the thread a reply belongs to) and returns the
+# ids of the threads that have more replies than the ones that were shown.
+REPLY_COUNTS = [{'$group': {'_id': {'$arrayElemAt': ['$ancestors', 0]}, 'count': {'$sum': 1}}}]
+
+def cutThreads(threads, replies):
+    counts = Comment.objects(ancestors__in=[t.id for t in threads]).aggregate(REPLY_COUNTS)
+    return truncatedThreads(replies, counts)
+
+# counts are the rows from the REPLY_COUNTS aggregation
+def truncatedThreads(replies, counts):
+    shown = {}
+    for reply in replies:
+        if reply.ancestors:
+            shown[reply.ancestors[0]] = shown.get(reply.ancestors[0], 0) + 1
+    return {row['_id'] for row in counts if row['count'] > shown.get(row['_id'], 0)}
+
+# This is a helper function that gets one thread (a top comment and its replies), oldest
+# reply first. after is the cursor of the last reply on the previous page.
+def getThreadPage(post, threadID, after=None):
+    try:
+        thread = Comment.objects.get(id=threadID, post=post.id)
+    except (mongoengine.errors.DoesNotExist, mongoengine.errors.ValidationError):
+        abort(404)
+    limit = app.config['REPLIES_PER_PAGE']
+    replies = list(threadRepliesQuery(thread.id, after).limit(limit + 1))
+    nextCursor = encodeCursor(replies[limit - 1]) if len(replies) > limit else None
+    return [thread], replies[:limit], nextCursor
 
 # This route will get one specific post and any comments associated with that post.  
 # The postID is a variable that must be passsed as a parameter to the function and 
@@ -40,9 +301,19 @@ def post(postID):
     # there is a field on the comment collection called 'post' that is a reference the Post
     # document it is related to.  You can use the postID to get the post and then you can use
     # the post object (thisPost in this case) to get all the comments.
-    theseComments = Comment.objects(post=thisPost)
+    # Comments are shown a page of threads at a time, or one thread if ?thread= is in the url.
+    threadID = request.args.get('thread')
+    truncated = set()
+    if threadID:
+        theseComments, replies, nextCursor = getThreadPage(thisPost, threadID, request.args.get('after'))
+    else:
+        theseComments, replies, nextCursor, truncated = getCommentPage(thisPost, request.args.get('after'))
+    # This gets the authors of the post and all of the comments in one query.
+    loadAuthors([thisPost] + theseComments + replies)
     # Send the post object and the comments object to the 'post.html' template.
-    return render_template('post.html',post=thisPost,comments=theseComments)
+    # children has the replies for each comment.
+    return render_template('post.html',post=thisPost,comments=theseComments,children=buildCommentTree(theseComments, replies),
+        threadID=threadID,nextCursor=nextCursor,truncated=truncated)
 
 # This route will delete a specific post.  You can only delete the post if you are the author.
 # <postID> is a variable sent to this route by the user who clicked on the trash can in the 
@@ -64,10 +335,10 @@ def postDelete(postID):
     else:
         # if the user is not the author tell them they were denied.
         flash("You can't delete a post you don't own.")
-    # Retrieve all of the remaining posts so that they can be listed.
-    posts = Post.objects()  
+    # Retrieve the first page of the remaining posts so that they can be listed.
+    posts, nextCursor, prevCursor = getPostPage()
     # Send the user to the list of remaining posts.
-    return render_template('posts.html',posts=posts)
+    return render_template('posts.html',posts=posts,nextCursor=nextCursor,prevCursor=prevCursor,sort='newest')
 
 
 # This route actually does two things depending on the state of the if statement 
@@ -102,6 +373,8 @@ def postNew():
             # This sets the modifydate to the current datetime.
             modifydate = dt.datetime.utcnow
         )
+        # A new post has had no activity except being created
+        newPost.lastactivity = newPost.createdate
         # This is a method that saves the data to the mongoDB database.
         newPost.save()
 
@@ -170,12 +443,26 @@ def postEdit(postID):
 def commentNew(postID):
     post = Post.objects.get(id=postID)
     form = CommentForm()
+    # ?parent=<commentID> in the url means this comment is a reply to that comment
+    parent = None
+    if request.args.get('parent'):
+        try:
+            parent = Comment.objects.only('post', 'ancestors', 'depth').get(id=request.args['parent'], post=post.id)
+        except (mongoengine.errors.DoesNotExist, mongoengine.errors.ValidationError):
+            abort(404)
+        # too deep, so reply to the parent's parent instead
+        if parent.depth + 1 > MAX_COMMENT_DEPTH:
+            parent = Comment.objects.only('post', 'ancestors', 'depth').get(id=parent.ancestors[-1])
     if form.validate_on_submit():
         newComment = Comment(
             author = current_user.id,
             post = postID,
             content = form.content.data
         )
+        if parent:
+            newComment.parent = parent.id
+            newComment.ancestors = parent.ancestors + [parent.id]
+            newComment.depth = parent.depth + 1
         newComment.save()
         return redirect(url_for('post',postID=postID))
     return render_template('commentform.html',form=form,post=post)
@@ -204,6 +491,11 @@ def commentEdit(commentID):
 @login_required
 def commentDelete(commentID): 
     deleteComment = Comment.objects.get(id=commentID)
+    if current_user != deleteComment.author:
+        flash("You can't delete a comment you didn't write.")
+        return redirect(url_for('post',postID=deleteComment.post.id))
+    # the replies to this comment (and their replies) are deleted with it
+    Comment.objects(ancestors=deleteComment.id).delete()
     deleteComment.delete()
     flash('The comments was deleted.')
     return redirect(url_for('post',postID=deleteComment.post.id)) 
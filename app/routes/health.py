@@ -0,0 +1,31 @@
+# These routes are for the web server or load balancer, not for people. They are
+# checked every few seconds to decide if this copy of the site is working.
+
+from app import app
+from flask import jsonify
+from mongoengine.connection import get_db
+from pymongo.errors import PyMongoError
+from app.utils.users import missingUniqueIndexes
+
+# Liveness: the process is running and can answer requests. This doesn't touch the
+# database so a database problem doesn't make the server restart every worker.
+@app.route('/healthz')
+def healthz():
+    return jsonify(status='ok')
+
+# Readiness: the site can do its job, which means MongoDB answers and the unique user
+# indexes exist (without them two people could sign up with the same username). If not,
+# the load balancer should stop sending traffic here until it is fixed.
+@app.route('/readyz')
+def readyz():
+    try:
+        get_db().command('ping')
+        missing = missingUniqueIndexes()
+    except PyMongoError:
+        # the error can name database servers and users so it only goes in the log
+        app.logger.exception('readyz: MongoDB ping failed')
+        return jsonify(status='unavailable', mongo='unavailable'), 503
+    if missing:
+        app.logger.error("readyz: no unique index on user %s, run 'flask db indexes'", ', '.join(missing))
+        return jsonify(status='unavailable', mongo='ok', indexes='missing'), 503
+    return jsonify(status='ok', mongo='ok')
@@ -0,0 +1,101 @@
+# These routes send the images that users upload (profile pictures and story page
+# pictures) to the browser. Images are stored in MongoDB using GridFS which splits
+# each file in to small 'chunks'. Instead of reading the whole image and pasting it
+# in to the html, templates link to these routes and the browser downloads (and caches)
+# the image separately.
+
+from app import app
+import mongoengine.errors
+from flask import request, abort, flash, redirect
+from flask_login import login_required
+from jinja2 import pass_context
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import wrap_file
+from app.classes.data import User, StoryPage
+from app.utils.images import VARIANTS
+
+# How long (in seconds) the browser may keep an image before asking again.  Image
+# urls include the id of the stored file so a new upload always gets a new url.
+app.config.setdefault('IMAGE_CACHE_TIMEOUT', 60 * 60 * 24 * 365)
+# How many bytes are read from GridFS at a time while sending an image
+app.config.setdefault('IMAGE_CHUNK_SIZE', 255 * 1024)
+
+# This is a helper function that builds the streaming response for a stored file.
+# gridOut is the file object returned by GridFS.  It is never read all at once,
+# wrap_file() reads it one chunk at a time as the browser downloads it.
+# public=False stops shared caches (like a proxy) from keeping a copy, only the
+# browser of the person who asked for it may cache it.
+def sendGridFile(gridOut, public=True):
+    data = wrap_file(request.environ, gridOut, buffer_size=app.config['IMAGE_CHUNK_SIZE'])
+    rv = Response(data, mimetype=gridOut.content_type or 'application/octet-stream', direct_passthrough=True)
+    rv.content_length = gridOut.length
+    # Files in GridFS never change after they are stored so the file id is a strong etag
+    rv.set_etag(str(gridOut._id))
+    rv.last_modified = gridOut.upload_date
+    if public:
+        rv.cache_control.public = True
+    else:
+        rv.cache_control.private = True
+    rv.cache_control.max_age = app.config['IMAGE_CACHE_TIMEOUT']
+    # make_conditional answers 'If-None-Match'/'If-Modified-Since' with a 304 and
+    # 'Range' requests with a 206 that only contains the requested bytes.
+    return rv.make_conditional(request, accept_ranges=True, complete_length=gridOut.length)
+
+# This is a helper function that gets the stored image of a document or sends a 404.
+# variant is one of the names in VARIANTS or None for the original upload.  If the
+# variant has not been made yet the original is sent instead.
+def getImage(docClass, docID, variant=None):
+    if variant and variant not in VARIANTS:
+        abort(404)
+    fields = ['image'] + (['image_' + variant] if variant else [])
+    try:
+        # only() means that just the image fields are retrieved from the database
+        doc = docClass.objects.only(*fields).get(pk=docID)
+    except (mongoengine.errors.DoesNotExist, mongoengine.errors.ValidationError):
+        abort(404)
+    gridOut = None
+    if variant:
+        gridOut = getattr(doc, 'image_' + variant).get()
+    if not gridOut:
+        gridOut = doc.image.get()
+    if not gridOut:
+        abort(404)
+    return gridOut
+
+@app.route('/image/user/<userID>')
+@app.route('/image/user/<userID>/<variant>')
+# Profile pictures are only shown to people who are logged in, just like the pages
+# they appear on.  Story page pictures stay public.
+@login_required
+def userImage(userID, variant=None):
+    return sendGridFile(getImage(User, userID, variant), public=False)
+
+@app.route('/image/page/<pageID>')
+@app.route('/image/page/<pageID>/<variant>')
+def pageImage(pageID, variant=None):
+    return sendGridFile(getImage(StoryPage, pageID, variant))
+
+# This function is used in the templates to get the url of a User or StoryPage image.
+# for example: <img src="{{imageURL(current_user, 'thumb')}}">
+# The 'v' part of the url changes whenever a new image is uploaded.
+# pass_context gives it the template's variables, so it uses the same url_for as the
+# template. The async read server (app/asyncread) renders with its own url_for.
+@pass_context
+def imageURL(context, doc, variant=None):
+    url_for = context['url_for']
+    stored = getattr(doc, 'image_' + variant) if variant else None
+    if not stored:
+        variant = None
+        stored = doc.image
+    if isinstance(doc, User):
+        return url_for('userImage', userID=doc.id, variant=variant, v=stored.grid_id)
+    return url_for('pageImage', pageID=doc.id, variant=variant, v=stored.grid_id)
+
+app.jinja_env.globals.update(imageURL=imageURL)
+
+# This is shown instead of the plain '413 Request Entity Too Large' error page when an
+# upload is bigger than MAX_CONTENT_LENGTH. It sends the user back to the form.
+@app.errorhandler(413)
+def uploadTooLarge(e):
+    flash(f"That file is too big. Files can be up to {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB.")
+    return redirect(request.url)
@@ -10,16 +10,24 @@ from flask_login import current_user, login_user, logout_user
 import mongoengine.errors
 from app.classes.forms import ResetPasswordRequestForm
 from .mail import send_email
+from app.utils.usercache import getUser, invalidateUser
+from app.utils.passwords import PasswordBusy, throttle, loginFailed, loginSucceeded, countAttempt
+from app.utils.users import UNIQUE_FIELDS, duplicateField
 
-# This function is called by other functions to load the current user in to memory
+BUSY_MESSAGE = "Sorry, the server is very busy right now. Please try again in a moment."
+THROTTLED_MESSAGE = "Too many tries. Please wait a few minutes and try again."
+
+# This function is called by other functions to load the current user in to memory.
+# getUser() keeps recently loaded users in memory so most requests don't need the database.
 @login.user_loader
 def load_user(id):
-    print('loading user')
     try:
-        return User.objects.get(pk=id)
-    except mongoengine.errors.DoesNotExist:
+        user = getUser(id)
+    except mongoengine.errors.ValidationError:
+        user = None
+    if user is None:
         flash("Something strange has happened. This user doesn't exist. Please click logout.")
-        return redirect(url_for('index'))
+    return user
 
 # This is the route that a user uses to login
 @app.route('/login', methods=['GET', 'POST'])
@@ -32,15 +40,32 @@ def login():
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
+        username = form.username.data
+        # checking a password is slow so each computer and each username only gets a few wrong tries
+        if not throttle(request.remote_addr, username):
+            flash(THROTTLED_MESSAGE)
+            return render_template('login.html', title='Sign In', form=form), 429
         try:
-            user = User.objects.get(username=form.username.data)
+            user = User.objects.get(username=username)
         except mongoengine.errors.DoesNotExist:
+            loginFailed(request.remote_addr, username)
             flash('Invalid username or password')
             return redirect(url_for('login'))
-        else:
-            if user is None or not user.check_password(form.password.data):
-                flash('Invalid username or password')
-                return redirect(url_for('login'))
+        try:
+            correct = user.check_password(form.password.data)
+        except PasswordBusy:
+            flash(BUSY_MESSAGE)
+            return render_template('login.html', title='Sign In', form=form), 503
+        if not correct:
+            loginFailed(request.remote_addr, username)
+            flash('Invalid username or password')
+            return redirect(url_for('login'))
+        loginSucceeded(username)
+        try:
+            user.upgrade_password(form.password.data)
+        except PasswordBusy:
+            # not a problem, it is tried again next time they log in
+            pass
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
@@ -61,15 +86,29 @@ def register():
         return redirect(url_for('index'))
     form = RegistrationForm()
     if form.validate_on_submit():
+        if not throttle(request.remote_addr):
+            flash(THROTTLED_MESSAGE)
+            return render_template('register.html', title='Register', form=form), 429
+        countAttempt(request.remote_addr)
         newUser = User(
             username=form.username.data, 
             fname=form.fname.data,
             lname=form.lname.data,
             email=form.email.data
             )
-        newUser.save()
-        newUser.set_password(form.password.data)
-        newUser.save()
+        try:
+            newUser.set_password(form.password.data)
+        except PasswordBusy:
+            flash(BUSY_MESSAGE)
+            return render_template('register.html', title='Register', form=form), 503
+        # One insert and nothing else. If the username or email is taken the unique
+        # index stops the insert and the error is shown next to that field on the form.
+        try:
+            newUser.save(force_insert=True)
+        except mongoengine.errors.NotUniqueError as e:
+            field = duplicateField(e) or 'username'
+            getattr(form, field).errors.append(UNIQUE_FIELDS[field])
+            return render_template('register.html', title='Register', form=form)
 
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('login'))
@@ -81,7 +120,7 @@ def register():
 # This funtion does not have a route and is called by other functions.
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
-    send_email('[Capstone] Reset Your Password',
+    return send_email('[Capstone] Reset Your Password',
                sender='swright@ousd.org',
                recipients=[user.email],
                text_body=render_template('email/reset_password.txt',
@@ -106,8 +145,17 @@ def reset_password(token):
             return redirect(url_for('index'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        user.set_password(form.password.data)
+        if not throttle(request.remote_addr):
+            flash(THROTTLED_MESSAGE)
+            return render_template('reset_password.html', form=form), 429
+        countAttempt(request.remote_addr)
+        try:
+            user.set_password(form.password.data)
+        except PasswordBusy:
+            flash(BUSY_MESSAGE)
+            return render_template('reset_password.html', form=form), 503
         user.save()
+        invalidateUser(user.id)
         flash('Your password has been reset.')
         return redirect(url_for('login'))
     return render_template('reset_password.html', form=form)
@@ -125,8 +173,11 @@ def reset_password_request():
             return redirect(url_for('index'))
         else:
             if user:
-                send_password_reset_email(user)
-                flash('Check your email for the instructions to reset your password')
+                # The email is sent in the background so this returns right away
+                if send_password_reset_email(user):
+                    flash('Check your email for the instructions to reset your password')
+                else:
+                    flash("Sorry, too many emails are waiting to be sent. Please try again in a few minutes.")
             else:
                 flash("Sorry, I was unable to find the user to send the reset email. Please try again.")
         return redirect(url_for('login'))
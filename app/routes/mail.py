@@ -1,9 +1,110 @@
 from flask_mail import Message
-from app import mail
+from app import app, mail
+import os
+import queue
+import smtplib
+import threading
+import time
 
-# This is a helper function for sending email messages
+# Sending an email means talking to the mail server which can take several seconds.
+# Instead of making the user wait, send_email() puts the message in a queue (the 'outbox')
+# and returns right away.  A few background threads take messages out of the outbox
+# and send them.  If sending fails the message is tried again later, waiting twice as
+# long each time.
+#
+# MAIL_SUPPRESS_SEND = True makes Flask-Mail skip connecting at all, so it never tests
+# the sending or the retries. To try them without a real mail server point MAIL_SERVER
+# and MAIL_PORT at a local debugging server, for example:
+#     python -m aiosmtpd -n -l localhost:8025        (pip install aiosmtpd)
+# with MAIL_SERVER='localhost', MAIL_PORT=8025, MAIL_USE_TLS=0. tests/test_mail.py does
+# the same with a tiny server of its own.
+
+app.config.setdefault('MAIL_QUEUE_SIZE', 1000)
+app.config.setdefault('MAIL_WORKERS', 2)
+app.config.setdefault('MAIL_MAX_RETRIES', 5)
+# seconds to wait before the first retry
+app.config.setdefault('MAIL_RETRY_DELAY', 2)
+
+# These are the errors that might go away if we try again later
+RETRY_ERRORS = (smtplib.SMTPException, OSError)
+
+outbox = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+_stats = {'queued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'dropped': 0, 'lastError': None, 'sendSeconds': 0.0}
+_lock = threading.Lock()
+# The id of the process that started the workers. Threads don't survive a fork so a
+# new web server process has to start its own.
+_workersPid = None
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+# This returns a copy of the delivery counters plus the current queue length
+def mailStats():
+    with _lock:
+        stats = dict(_stats)
+    stats['waiting'] = outbox.qsize()
+    return stats
+
+def _startWorkers():
+    global _workersPid
+    with _lock:
+        if _workersPid == os.getpid():
+            return
+        _workersPid = os.getpid()
+    for i in range(app.config['MAIL_WORKERS']):
+        threading.Thread(target=_worker, name=f'mail-worker-{i}', daemon=True).start()
+
+def _requeue(msg, attempt):
+    try:
+        outbox.put_nowait((msg, attempt))
+    except queue.Full:
+        _count('dropped')
+
+def _worker():
+    while True:
+        msg, attempt = outbox.get()
+        start = time.perf_counter()
+        try:
+            # Flask-Mail needs an app context to know the mail settings
+            with app.app_context():
+                mail.send(msg)
+        except RETRY_ERRORS as e:
+            with _lock:
+                _stats['lastError'] = repr(e)
+            if attempt < app.config['MAIL_MAX_RETRIES']:
+                _count('retried')
+                delay = app.config['MAIL_RETRY_DELAY'] * 2 ** attempt
+                timer = threading.Timer(delay, _requeue, args=(msg, attempt + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                _count('failed')
+                app.logger.error('Giving up on email %s %r to %s: %r', msg.msgId, msg.subject, msg.recipients, e)
+        except Exception as e:
+            # Anything else is a bug (a bad address or message, for example) that won't
+            # go away by trying again. It is logged so the worker thread keeps running.
+            with _lock:
+                _stats['lastError'] = repr(e)
+            _count('failed')
+            app.logger.exception('Could not send email %s %r to %s', msg.msgId, msg.subject, msg.recipients)
+        else:
+            _count('sent')
+        finally:
+            _count('sendSeconds', time.perf_counter() - start)
+            outbox.task_done()
+
+# This is a helper function for sending email messages. It returns False if the
+# outbox is full and the message could not be queued.
 def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    mail.send(msg)
\ No newline at end of file
+    _startWorkers()
+    try:
+        outbox.put_nowait((msg, 0))
+    except queue.Full:
+        _count('dropped')
+        return False
+    _count('queued')
+    return True
@@ -0,0 +1,22 @@
+# This route shows how fast each route has been since the server started. It is
+# turned off unless app.config['METRICS_ENABLED'] is True, or METRICS_ENABLED=1 is in
+# the environment (for the benchmark, see bench/readme.txt).
+
+import os
+from app import app
+from flask import jsonify, abort
+from app.utils.dbmetrics import endpointMetrics, connectionStats
+from app.utils.compression import compressionStats
+from .mail import mailStats
+
+app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED') == '1')
+
+@app.route('/metrics')
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    data = endpointMetrics()
+    data['mail'] = mailStats()
+    data['compression'] = compressionStats()
+    data['connections'] = connectionStats()
+    return jsonify(data)
@@ -11,29 +11,30 @@ from app.classes.data import Post, Comment
 from app.classes.forms import PostForm, CommentForm
 from flask_login import login_required
 import datetime as dt
+from app.utils.pagecache import renderStatic
 
 @app.route("/quiz")
 def quiz():
-    return render_template('quiz.html')
+    return renderStatic('quiz.html')
 
 @app.route("/happy")
 def happy():
-    return render_template('happy.html')
+    return renderStatic('happy.html')
 
 @app.route("/sad")
 def sad():
-    return render_template('sad.html')
+    return renderStatic('sad.html')
 
 
 @app.route("/mad")
 def mad():
-    return render_template('mad.html')
+    return renderStatic('mad.html')
 
 @app.route("/tired")
 def tired():
-    return render_template('tired.html')
+    return renderStatic('tired.html')
 
 @app.route("/annoyed")
 def annoyed():
-    return render_template('annoyed.html')
+    return renderStatic('annoyed.html')
 
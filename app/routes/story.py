@@ -1,23 +1,55 @@
-from email import contentmanager
-from multiprocessing import AuthenticationError
-from turtle import title
 from app import app, login
 import mongoengine.errors
-from flask import render_template, flash, redirect, url_for
+from flask import render_template, flash, redirect, url_for, request, jsonify
 from flask_login import current_user
 from app.classes.data import StoryPage
 from app.classes.forms import StoryPageForm
+from app.utils.images import saveImage, deleteImages
+from app.utils.storygraph import getStoryGraph, updateStoryPage, removeStoryPage
 from flask_login import login_required
 from bson.objectid import ObjectId
 import datetime as dt
 
-def getPages():
-    pages=StoryPage.objects()
-    pageChoices = []
-    for page in pages:
-        pageChoices.append((page.id,page.title))
+# The c1 and c2 dropdowns only list the pages that are already chosen. The page form
+# searches for other pages by title using the '/page/search' route below so that every
+# page in the story doesn't have to be sent with the form.
+# The pages that are already chosen are always listed, even if the story graph doesn't
+# know them yet (it can be a few seconds old) or they don't have a title. Otherwise the
+# dropdown would only show 'no choice' and saving the form would remove the choice.
+def getPageChoices(*pageIDs):
+    graph = getStoryGraph()
+    # ids that aren't ObjectIds (a bad form value) can't be pages so they are left out
+    pageIDs = [str(pageID) for pageID in pageIDs if pageID and ObjectId.is_valid(pageID)]
+    titles = {pageID: graph.title(pageID) for pageID in pageIDs}
+    missing = [pageID for pageID, title in titles.items() if title is None]
+    if missing:
+        # One query for the pages the graph doesn't have a title for, only() gets just
+        # the title. Pages that aren't found here don't exist any more.
+        found = {str(p.id): p.title for p in StoryPage.objects(id__in=missing).only('title')}
+        for pageID in missing:
+            if pageID in found:
+                titles[pageID] = found[pageID] or '(untitled page)'
+            else:
+                del titles[pageID]
+    pageChoices = [('', 'no choice')]
+    for pageID, title in titles.items():
+        pageChoices.append((pageID, title))
     return pageChoices
 
+# This turns the id from a c1/c2 dropdown in to an ObjectId or None if nothing was chosen.
+# StoryPageForm has already checked that it is the id of a page that exists.
+def choiceID(value):
+    return ObjectId(value) if value else None
+
+# This is called by the javascript on pageform.html as the user types in the search box.
+# /page/search?q=dark returns [{"id": "...", "title": "Dark Forest"}, ...]
+@app.route('/page/search')
+@login_required
+def pageSearch():
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    results = getStoryGraph().searchTitles(request.args.get('q', ''), limit)
+    return jsonify([{'id': str(pageID), 'title': title} for pageID, title in results])
+
 @app.route('/page/new', methods=['GET','POST'])
 @login_required
 def pageNew():
@@ -28,19 +60,22 @@ def pageNew():
             author = current_user.id,
             title = form.title.data,
             content = form.content.data,
-            c1 = form.c1.data,
-            c2 = form.c2.data
+            c1 = choiceID(form.c1.data),
+            c2 = choiceID(form.c2.data)
         )
         newPage.save()
         newPage.reload()
         if form.image.data:
-            newPage.image.put(form.image.data, content_type = 'image/jpeg')
-            # This saves all the updates
-            newPage.save()
+            try:
+                saveImage(newPage, form.image.data)
+            except ValueError as e:
+                flash(str(e))
+                return redirect(url_for('pageEdit', pageID = newPage.id))
+        updateStoryPage(newPage.id)
 
         return redirect(url_for('page', pageID = newPage.id))
 
-    pageChoices = getPages()
+    pageChoices = getPageChoices(form.c1.data, form.c2.data)
     form.c1.choices = pageChoices
     form.c2.choices = pageChoices
     return render_template('pageform.html', form=form, page=None)
@@ -55,22 +90,29 @@ def pageEdit(pageID):
         editPage.update(
             title = form.title.data,
             content = form.content.data,
-            c1 = ObjectId(form.c1.data),
-            c2 = ObjectId(form.c2.data)
+            c1 = choiceID(form.c1.data),
+            c2 = choiceID(form.c2.data)
         )
         if form.image.data:
-            if editPage.image:
-                editPage.image.delete()
-            editPage.image.put(form.image.data, content_type = 'image/jpeg')
-            editPage.save()
+            try:
+                saveImage(editPage, form.image.data)
+            except ValueError as e:
+                flash(str(e))
+                return redirect(url_for('pageEdit', pageID = editPage.id))
+        updateStoryPage(editPage.id)
 
         return redirect(url_for('page', pageID = editPage.id))
 
-    pageChoices = getPages()
+    # _data has the ids of the choices without getting the choice pages from the database
+    c1ID = editPage._data.get('c1')
+    c2ID = editPage._data.get('c2')
+    c1ID = str(c1ID.id) if c1ID else ''
+    c2ID = str(c2ID.id) if c2ID else ''
+    pageChoices = getPageChoices(c1ID, c2ID)
     form.c1.choices = pageChoices
     form.c2.choices = pageChoices
-    form.c1.default = editPage.c1.id
-    form.c2.default = editPage.c2.id
+    form.c1.default = c1ID
+    form.c2.default = c2ID
     form.process()
     form.title.data = editPage.title
     form.content.data = editPage.content
@@ -81,22 +123,31 @@ def pageEdit(pageID):
 @app.route('/page/<pageID>')
 def page(pageID):
     thisPage = StoryPage.objects.get(pk=pageID)
-    return render_template('page.html',page=thisPage)
+    # The two choices come from the story graph that is kept in memory
+    c1, c2 = getStoryGraph().choices(thisPage.id)
+    return render_template('page.html',page=thisPage,c1=c1,c2=c2)
 
 @app.route('/pages')
 def pages():
     pages=StoryPage.objects()
     return render_template('pages.html',pages=pages)
 
+# The start page of each story is set in app.config['STORY_START_PAGES']
 @app.route('/page/start')
-def startPage():
-    thisPage = StoryPage.objects.get(pk='6269746f15559196d7dc660d')
-    return render_template('page.html',page=thisPage)
+@app.route('/page/start/<story>')
+def startPage(story='default'):
+    startID = getStoryGraph().startPage(story)
+    if not startID:
+        flash("This story doesn't have any pages yet.")
+        return redirect(url_for('pages'))
+    return page(startID)
 
 
 @app.route('/page/delete/<pageID>')
 def pageDelete(pageID):
     deletePage = StoryPage.objects.get(pk=pageID)
     deletePage.delete()
+    deleteImages(deletePage)
+    removeStoryPage(deletePage.id)
     flash('Page was deleted')
     return redirect(url_for('pages'))
\ No newline at end of file
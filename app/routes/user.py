@@ -5,6 +5,8 @@ from flask import render_template, redirect, flash, url_for
 from app.classes.data import User
 from app.classes.forms import ProfileForm
 from flask_login import current_user
+from app.utils.images import saveImage
+from app.utils.usercache import invalidateUser
 
 # These routes and functions are for accessing and editing user profiles.
 
@@ -38,13 +40,17 @@ def profileEdit():
             fname = form.fname.data,
             role = form.role.data
         )
-        # This updates the profile image
+        # This updates the profile image and makes the smaller copies of it.
+        # saveImage() also saves the user.
         if form.image.data:
-            if currUser.image:
-                currUser.image.delete()
-            currUser.image.put(form.image.data, content_type = 'image/jpeg')
-            # This saves all the updates
-            currUser.save()
+            try:
+                saveImage(currUser, form.image.data)
+            except ValueError as e:
+                invalidateUser(currUser.id)
+                flash(str(e))
+                return render_template('profileform.html', form=form)
+        # This makes sure the next page shows the changes instead of the remembered user
+        invalidateUser(currUser.id)
         # Then sends the user to their profle page
         return redirect(url_for('myProfile'))
 
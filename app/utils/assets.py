@@ -0,0 +1,170 @@
+# This file gets the files in app/static ready to be sent to browsers quickly.
+# 'flask assets build' (see commands.py) copies every static file in to app/static/dist
+# with a short 'fingerprint' of its contents in the name, for example
+#     local.css  ->  local.3f9a0c2b71de.css
+# Because the name changes whenever the file changes, the browser can be told to keep
+# the file forever and never ask about it again (see routes/assets.py).  Along the way:
+#   - png and jpeg pictures are shrunk to at most ASSET_MAX_IMAGE_SIZE pixels and saved
+#     with better compression (the original is kept if it was already smaller)
+#   - text files like css get a .gz copy (and a .br copy if the 'brotli' package is
+#     installed) so they don't have to be compressed on every request
+# The list of original names and fingerprinted names is saved in manifest.json.
+# Templates use assetURL('local.css') which looks the name up in the manifest.  If
+# the build hasn't been run the normal /static url is used instead.
+
+import gzip
+import hashlib
+import json
+import os
+from io import BytesIO
+from jinja2 import pass_context
+from PIL import Image
+from app import app
+from app.utils.images import openImage, JPEG_QUALITY
+
+# brotli compresses better than gzip but it is an extra package so it is optional
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+app.config.setdefault('ASSET_DIR', os.path.join(app.static_folder, 'dist'))
+# The biggest width/height (in pixels) of the pictures in app/static
+app.config.setdefault('ASSET_MAX_IMAGE_SIZE', 1600)
+app.config.setdefault('ASSET_GZIP_LEVEL', 9)
+app.config.setdefault('ASSET_BROTLI_QUALITY', 11)
+
+# Files with these endings get precompressed copies. Pictures are already compressed.
+COMPRESS_TYPES = ('.css', '.js', '.svg', '.ico', '.txt', '.json', '.html')
+IMAGE_TYPES = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+MANIFEST = 'manifest.json'
+# How many characters of the sha-256 hash go in to the file name
+HASH_LENGTH = 12
+
+# This re-encodes a picture so that it is smaller. It returns the original bytes if
+# they can't be read as a picture or the new ones aren't any smaller.
+def optimizeImage(data, ext):
+    try:
+        img = openImage(BytesIO(data))
+    except ValueError:
+        return data
+    size = app.config['ASSET_MAX_IMAGE_SIZE']
+    img.thumbnail((size, size), Image.LANCZOS)
+    out = BytesIO()
+    if IMAGE_TYPES[ext] == 'PNG':
+        img.save(out, format='PNG', optimize=True)
+    else:
+        img.convert('RGB').save(out, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+# This returns the precompressed copies of data that are worth keeping: {'.gz': bytes, '.br': bytes}
+def compressAsset(data):
+    copies = {'.gz': gzip.compress(data, compresslevel=app.config['ASSET_GZIP_LEVEL'], mtime=0)}
+    if brotli:
+        copies['.br'] = brotli.compress(data, quality=app.config['ASSET_BROTLI_QUALITY'])
+    return {suffix: copy for suffix, copy in copies.items() if len(copy) < len(data)}
+
+def _writeFile(path, data):
+    # write to a temporary name and then rename so a request never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+# This returns the names (like 'img/logo.png') of all of the files in app/static
+# except the build output
+def staticFiles():
+    static = app.static_folder
+    outDir = os.path.abspath(app.config['ASSET_DIR'])
+    for root, dirs, files in os.walk(static):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != outDir)
+        for name in sorted(files):
+            if name.startswith('.') or name == 'readme.txt':
+                continue
+            yield os.path.relpath(os.path.join(root, name), static).replace(os.sep, '/')
+
+# This is what 'flask assets build' runs. It returns a list of
+# (name, fingerprinted name, original bytes, built bytes, {suffix: compressed bytes})
+# for the report. Files that were built before (same contents) are not built again.
+# Old fingerprinted files are kept so pages that are already cached still work,
+# unless clean is True.
+def buildAssets(clean=False):
+    outDir = app.config['ASSET_DIR']
+    manifest = {}
+    report = []
+    for name in staticFiles():
+        with open(os.path.join(app.static_folder, name), 'rb') as f:
+            data = f.read()
+        # the fingerprint comes from the original file so unchanged files can be skipped
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        root, ext = os.path.splitext(name)
+        ext = ext.lower()
+        built = f'{root}.{digest}{ext}'
+        path = os.path.join(outDir, built)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                output = f.read()
+            copies = {suffix: None for suffix in ('.gz', '.br') if os.path.exists(path + suffix)}
+        else:
+            output = optimizeImage(data, ext) if ext in IMAGE_TYPES else data
+            copies = compressAsset(output) if ext in COMPRESS_TYPES else {}
+            _writeFile(path, output)
+            for suffix, copy in copies.items():
+                _writeFile(path + suffix, copy)
+        manifest[name] = built
+        report.append((name, built, len(data), len(output), copies))
+    _writeFile(os.path.join(outDir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    if clean:
+        keep = {MANIFEST} | {built + suffix for built in manifest.values() for suffix in ('', '.gz', '.br')}
+        for root, dirs, files in os.walk(outDir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, outDir).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+    invalidateManifest()
+    return report
+
+# The manifest is read the first time assetURL() is called and again whenever the
+# manifest file changes, so running the build doesn't need a restart.
+_manifest = None
+_manifestMtime = None
+
+def loadManifest():
+    global _manifest, _manifestMtime
+    path = os.path.join(app.config['ASSET_DIR'], MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return {}
+    if _manifest is None or mtime != _manifestMtime:
+        with open(path) as f:
+            _manifest = json.load(f)
+        _manifestMtime = mtime
+    return _manifest
+
+# The change time of the manifest, or None if there isn't one. pagecache.py uses this to
+# forget the pages it kept that link to the files of an older build.
+def manifestVersion():
+    try:
+        return os.stat(os.path.join(app.config['ASSET_DIR'], MANIFEST)).st_mtime_ns
+    except OSError:
+        return None
+
+def invalidateManifest():
+    global _manifest
+    _manifest = None
+
+# This is used in the templates instead of url_for('static', ...), for example:
+#     <link rel="stylesheet" href="{{ assetURL('local.css') }}">
+# It can also be called like url_for: assetURL(filename='local.css')
+# Like imageURL() (routes/image.py) it uses the url_for of the template it is called from.
+@pass_context
+def assetURL(context, filename, **values):
+    url_for = context['url_for']
+    built = loadManifest().get(filename)
+    if built:
+        return url_for('asset', filename=built, **values)
+    return url_for('static', filename=filename, **values)
+
+app.jinja_env.globals.update(assetURL=assetURL)
@@ -0,0 +1,158 @@
+# This file compresses the pages and JSON that the site sends, which makes them several
+# times smaller.  Browsers say which kinds of compression they understand in the
+# 'Accept-Encoding' header, usually 'gzip, deflate, br'.  brotli ('br') makes smaller
+# files than gzip but it needs the optional 'brotli' package (pip install brotli).
+#
+# compressResponse() runs after every request. It leaves a response alone if:
+#   - it isn't a kind of file that compresses well (pictures are already compressed)
+#   - it is smaller than COMPRESS_MIN_SIZE bytes (the headers would cost more than we save)
+#   - it already has a Content-Encoding, like the precompressed files in routes/assets.py
+# Responses that are made a piece at a time (streamed) are compressed a piece at a time
+# too, so they still reach the browser as they are made.
+#
+# The number of bytes before and after and the time spent compressing are counted and
+# shown at /metrics.
+
+import threading
+import time
+import zlib
+from flask import request
+from werkzeug.wsgi import ClosingIterator
+from app import app
+
+# brotli is optional, without it only gzip is used
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+app.config.setdefault('COMPRESS_ENABLED', True)
+app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+# 1 is fastest, 9 is smallest. 6 is the usual balance.
+app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+# 0 is fastest, 11 is smallest. 11 is far too slow to do on every request.
+app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+app.config.setdefault('COMPRESS_MIMETYPES', {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript', 'text/csv',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+})
+
+_stats = {'responses': 0, 'bytesIn': 0, 'bytesOut': 0, 'seconds': 0.0, 'gzip': 0, 'br': 0}
+_lock = threading.Lock()
+
+def _count(encoding, bytesIn, bytesOut, seconds, responses=1):
+    with _lock:
+        _stats['responses'] += responses
+        _stats[encoding] += responses
+        _stats['bytesIn'] += bytesIn
+        _stats['bytesOut'] += bytesOut
+        _stats['seconds'] += seconds
+
+# This returns a copy of the counters for the /metrics route
+def compressionStats():
+    with _lock:
+        stats = dict(_stats)
+    stats['savedBytes'] = stats['bytesIn'] - stats['bytesOut']
+    stats['msPerResponse'] = round(stats['seconds'] * 1000 / stats['responses'], 3) if stats['responses'] else None
+    return stats
+
+# These make an object with compress(bytes) and flush() that works the same way for
+# both kinds of compression. flush(True) ends the stream.
+class _Gzip:
+    def __init__(self):
+        # wbits=31 means 'write a gzip header', which is what browsers expect for 'gzip'
+        self.z = zlib.compressobj(app.config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.z.compress(data)
+
+    def flush(self, finish=False):
+        return self.z.flush(zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH)
+
+class _Brotli:
+    def __init__(self):
+        self.z = brotli.Compressor(quality=app.config['COMPRESS_BROTLI_QUALITY'])
+
+    def compress(self, data):
+        return self.z.process(data)
+
+    def flush(self, finish=False):
+        return self.z.finish() if finish else self.z.flush()
+
+COMPRESSORS = {'gzip': _Gzip}
+if brotli:
+    COMPRESSORS['br'] = _Brotli
+
+# This picks the compression the browser likes best from the ones we have.
+# When the browser likes them equally brotli is picked.
+def chooseEncoding():
+    return request.accept_encodings.best_match([name for name in ('br', 'gzip') if name in COMPRESSORS])
+
+def _compressStream(chunks, encoding):
+    compressor = COMPRESSORS[encoding]()
+    bytesIn = bytesOut = 0
+    seconds = 0.0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        start = time.perf_counter()
+        # each piece is flushed so the browser gets it now instead of when the page ends
+        out = compressor.compress(chunk) + compressor.flush()
+        seconds += time.perf_counter() - start
+        bytesIn += len(chunk)
+        bytesOut += len(out)
+        if out:
+            yield out
+    out = compressor.flush(True)
+    bytesOut += len(out)
+    _count(encoding, bytesIn, bytesOut, seconds)
+    yield out
+
+def _compressible(response):
+    return (app.config['COMPRESS_ENABLED']
+            and response.mimetype in app.config['COMPRESS_MIMETYPES']
+            and 200 <= response.status_code < 300
+            and response.status_code not in (204, 206)
+            and 'Content-Encoding' not in response.headers)
+
+@app.after_request
+def compressResponse(response):
+    if not _compressible(response):
+        return response
+    # a cache in between has to keep the compressed and uncompressed copies apart
+    response.vary.add('Accept-Encoding')
+    encoding = chooseEncoding()
+    if not encoding or request.method == 'HEAD':
+        return response
+    if response.content_length is not None and response.content_length < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    if response.is_sequence and not response.direct_passthrough:
+        # the whole body is already in memory
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        start = time.perf_counter()
+        compressor = COMPRESSORS[encoding]()
+        out = compressor.compress(data) + compressor.flush(True)
+        _count(encoding, len(data), len(out), time.perf_counter() - start)
+        response.set_data(out)
+    else:
+        # the body is made while it is being sent so its size isn't known
+        chunks = response.response
+        stream = _compressStream(chunks, encoding)
+        if hasattr(chunks, 'close'):
+            stream = ClosingIterator(stream, chunks.close)
+        response.response = stream
+        response.direct_passthrough = False
+        del response.headers['Content-Length']
+
+    response.headers['Content-Encoding'] = encoding
+    # byte ranges of the compressed body wouldn't match the original file
+    del response.headers['Accept-Ranges']
+    # the compressed bytes are different from the uncompressed ones, so the ETag can only
+    # promise that the page means the same thing ('weak'), not that the bytes are the same
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,155 @@
+# This file measures how many MongoDB commands each request sends and how long they
+# take.  pymongo calls DBCommandListener after every command it sends (this is called
+# 'command monitoring'). The numbers for the current request are kept on flask's 'g'
+# object and at the end of the request they are:
+#   - added to the response as a 'Server-Timing' header (the browser dev tools show it)
+#   - written to the log if the request was slow
+#   - added to a histogram for the route that is shown at /metrics (see routes/metrics.py)
+
+import bisect
+import json
+import threading
+import time
+from flask import g, has_request_context, request
+from pymongo import monitoring
+from app import app
+
+# Requests that take longer than this many milliseconds are written to the log
+app.config.setdefault('SLOW_REQUEST_MS', 500)
+
+# The upper limits (in milliseconds) of the histogram buckets. The last bucket is everything slower.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+class DBCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        # Commands sent outside of a request (like from a flask command) aren't counted
+        if not has_request_context() or 'dbStats' not in g:
+            return
+        stats = g.dbStats
+        ms = event.duration_micros / 1000
+        stats['count'] += 1
+        stats['totalMs'] += ms
+        if ms > stats['maxMs']:
+            stats['maxMs'] = ms
+            stats['slowest'] = event.command_name
+
+# pymongo calls DBPoolListener when it opens or closes a connection to MongoDB. It
+# counts the connections this process has open and the most it has had open at once.
+# Both are shown at /metrics, which is how bench/run.py compares how many connections
+# each worker needs.
+class DBPoolListener(monitoring.ConnectionPoolListener):
+    def connection_created(self, event):
+        _countConnection(1)
+
+    def connection_closed(self, event):
+        _countConnection(-1)
+
+    # pymongo wants every one of these even though only the two above are used
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+_connections = {'open': 0, 'peak': 0}
+
+def _countConnection(change):
+    with _lock:
+        _connections['open'] += change
+        _connections['peak'] = max(_connections['peak'], _connections['open'])
+
+def connectionStats():
+    with _lock:
+        return dict(_connections)
+
+def registerListener():
+    monitoring.register(DBCommandListener())
+    monitoring.register(DBPoolListener())
+
+# These are the histograms for each route: {endpoint: {...}}
+_endpoints = {}
+_lock = threading.Lock()
+
+def _newEndpoint():
+    return {
+        'requests': 0,
+        'latencyBuckets': [0] * (len(BUCKETS_MS) + 1),
+        'dbBuckets': [0] * (len(BUCKETS_MS) + 1),
+        'dbCommands': 0,
+        'totalMs': 0.0,
+        'dbMs': 0.0,
+    }
+
+def _observe(endpoint, totalMs, stats):
+    with _lock:
+        e = _endpoints.setdefault(endpoint, _newEndpoint())
+        e['requests'] += 1
+        e['latencyBuckets'][bisect.bisect_left(BUCKETS_MS, totalMs)] += 1
+        e['dbBuckets'][bisect.bisect_left(BUCKETS_MS, stats['totalMs'])] += 1
+        e['dbCommands'] += stats['count']
+        e['totalMs'] += totalMs
+        e['dbMs'] += stats['totalMs']
+
+# This returns a copy of all of the histograms for the /metrics route
+def endpointMetrics():
+    with _lock:
+        endpoints = {name: dict(e, latencyBuckets=list(e['latencyBuckets']), dbBuckets=list(e['dbBuckets']))
+                     for name, e in _endpoints.items()}
+    return {'bucketsMs': list(BUCKETS_MS) + ['+Inf'], 'endpoints': endpoints}
+
+@app.before_request
+def startDBStats():
+    g.requestStart = time.perf_counter()
+    g.dbStats = {'count': 0, 'totalMs': 0.0, 'maxMs': 0.0, 'slowest': None}
+
+@app.after_request
+def finishDBStats(response):
+    if 'dbStats' not in g:
+        return response
+    stats = g.dbStats
+    totalMs = (time.perf_counter() - g.requestStart) * 1000
+    response.headers.add('Server-Timing', f'db;dur={stats["totalMs"]:.1f};desc="{stats["count"]} commands"')
+    response.headers.add('Server-Timing', f'db-max;dur={stats["maxMs"]:.1f};desc="{stats["slowest"] or "none"}"')
+    response.headers.add('Server-Timing', f'app;dur={totalMs:.1f}')
+    endpoint = request.endpoint or 'unknown'
+    _observe(endpoint, totalMs, stats)
+    if totalMs >= app.config['SLOW_REQUEST_MS']:
+        app.logger.warning('slow request %s', json.dumps({
+            'endpoint': endpoint,
+            'path': request.path,
+            'method': request.method,
+            'status': response.status_code,
+            'ms': round(totalMs, 1),
+            'dbCommands': stats['count'],
+            'dbMs': round(stats['totalMs'], 1),
+            'dbMaxMs': round(stats['maxMs'], 1),
+            'slowestCommand': stats['slowest'],
+        }))
+    return response
@@ -0,0 +1,75 @@
+# This finds files in GridFS that no User or StoryPage points to anymore and deletes
+# them. Files are left behind when a story page or a user (and everything they own) is
+# deleted. It is run with the 'flask images gc' command.
+#
+# The files are checked a batch at a time in order of their id, and the id reached is
+# saved in the 'gridfs_gc' collection so the next run carries on from there. That way
+# a big store can be cleaned a little at a time.
+
+import datetime as dt
+import gridfs
+from mongoengine.connection import get_db
+from app.classes.data import User, StoryPage
+
+IMAGE_FIELDS = ('image', 'image_thumb', 'image_card', 'image_full')
+DOCUMENTS = (User, StoryPage)
+BUCKET = 'fs'
+
+def _stateCollection():
+    return get_db()['gridfs_gc']
+
+# This returns the ids in fileIds that some User or StoryPage field points to.
+# Each query uses the sparse indexes on the image fields (see data.py).
+def referencedIds(fileIds):
+    found = set()
+    for docClass in DOCUMENTS:
+        collection = docClass._get_collection()
+        for field in IMAGE_FIELDS:
+            for doc in collection.find({field: {'$in': fileIds}}, {field: 1}):
+                found.add(doc[field])
+    return found
+
+# This checks up to maxBatches batches of files. Files newer than graceHours are never
+# deleted because an upload stores its files just before saving the document that points
+# at them. Returns a report of what was found (and deleted unless dryRun is True).
+def sweep(batchSize=500, maxBatches=None, graceHours=24, dryRun=True, restart=False):
+    db = get_db()
+    files = db[BUCKET + '.files']
+    fs = gridfs.GridFS(db, BUCKET)
+    state = _stateCollection()
+    cutoff = dt.datetime.utcnow() - dt.timedelta(hours=graceHours)
+    lastId = None
+    if not restart:
+        saved = state.find_one({'_id': BUCKET})
+        lastId = saved and saved.get('lastId')
+
+    report = {'checked': 0, 'orphans': 0, 'bytes': 0, 'deleted': 0, 'finished': False}
+    batches = 0
+    while maxBatches is None or batches < maxBatches:
+        query = {'_id': {'$gt': lastId}} if lastId else {}
+        batch = list(files.find(query, {'length': 1, 'uploadDate': 1}).sort('_id', 1).limit(batchSize))
+        if not batch:
+            report['finished'] = True
+            lastId = None
+            break
+        batches += 1
+        report['checked'] += len(batch)
+        lastId = batch[-1]['_id']
+        old = [f for f in batch if f.get('uploadDate') and f['uploadDate'] < cutoff]
+        referenced = referencedIds([f['_id'] for f in old])
+        orphans = [f for f in old if f['_id'] not in referenced]
+        report['orphans'] += len(orphans)
+        report['bytes'] += sum(f.get('length', 0) for f in orphans)
+        if orphans and not dryRun:
+            # check again right before deleting in case a document started using one
+            stillReferenced = referencedIds([f['_id'] for f in orphans])
+            for f in orphans:
+                if f['_id'] not in stillReferenced:
+                    fs.delete(f['_id'])
+                    report['deleted'] += 1
+        if not dryRun:
+            state.update_one({'_id': BUCKET}, {'$set': {'lastId': lastId, 'updated': dt.datetime.utcnow()}}, upsert=True)
+    if report['finished'] and not dryRun:
+        # start from the beginning next time
+        state.delete_one({'_id': BUCKET})
+    return report
@@ -0,0 +1,187 @@
+# These are helper functions for images that users upload.  When an image is uploaded
+# a few smaller copies ('variants') are made and stored next to the original so that
+# pages that only show a small picture don't have to download the whole upload.
+# This uses the Pillow library: https://pillow.readthedocs.io
+#
+# Uploads are copied in to GridFS a chunk at a time instead of being read in to memory
+# all at once. The new files are written first and then the document is changed to
+# point at them with one save, so if anything goes wrong half way the old image is
+# still there. The old files are deleted after the save.
+
+from io import BytesIO
+import gridfs
+from mongoengine.connection import get_db
+from mongoengine.fields import GridFSProxy
+from PIL import Image, ImageOps, UnidentifiedImageError
+from app import app
+
+# The biggest image (in bytes) that can be uploaded. Whole requests are also limited by
+# MAX_CONTENT_LENGTH (see app/__init__.py).
+app.config.setdefault('MAX_IMAGE_BYTES', 8 * 1024 * 1024)
+# The most pixels an image can have. This stops a small file that unpacks in to a giant
+# picture from using up all of the memory. openImage() checks it before the picture is
+# unpacked. Pillow's own check is kept as a backstop but it only stops images with more
+# than twice this many pixels (between 1x and 2x it just prints a warning).
+app.config.setdefault('MAX_IMAGE_PIXELS', 40 * 1000 * 1000)
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+
+# The name of each variant and the largest width/height (in pixels) it can have.
+# Each variant is stored in the document field 'image_<name>', for example 'image_thumb'.
+VARIANTS = {
+    'thumb': 240,
+    'card': 480,
+    'full': 1600,
+}
+
+JPEG_QUALITY = 85
+# How many bytes are copied in to GridFS at a time. This is GridFS's own chunk size.
+CHUNK_SIZE = 255 * 1024
+
+# The first bytes of each kind of image file we accept
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+# This looks at the first bytes of a file to see what kind of image it really is. The
+# name and content type sent by the browser can't be trusted. Returns None if it's not an image.
+def sniffContentType(head):
+    for signature, contentType in SIGNATURES:
+        if head.startswith(signature):
+            return contentType
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+# This is a helper function that opens an uploaded file as an image.  It raises a
+# ValueError if it's not an image that Pillow understands or it is too big.
+def openImage(stream, draftSize=None):
+    try:
+        img = Image.open(stream)
+        # open() only reads the header, so the size is known before anything is unpacked
+        width, height = img.size
+        if width * height > app.config['MAX_IMAGE_PIXELS']:
+            raise ValueError('The uploaded image is too big.')
+        if draftSize:
+            # for jpegs this lets Pillow decode a smaller picture which is much faster
+            img.draft('RGB', (draftSize, draftSize))
+        img.load()
+        # Phones save photos sideways and add an EXIF 'orientation' note saying which way
+        # to turn them. The variants are turned the right way up here because the note
+        # isn't copied in to them.
+        img = ImageOps.exif_transpose(img)
+    except Image.DecompressionBombError as e:
+        raise ValueError('The uploaded image is too big.') from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError('The uploaded file is not an image.') from e
+    return img
+
+# This resizes an image so that it fits inside a size x size square and re-encodes it.
+# Images with transparency are saved as PNG and everything else as JPEG.
+# It returns the new bytes and the content type that goes with them.
+def makeVariant(img, size):
+    variant = img.copy()
+    variant.thumbnail((size, size), Image.LANCZOS)
+    out = BytesIO()
+    if variant.mode in ('RGBA', 'LA') or (variant.mode == 'P' and 'transparency' in variant.info):
+        variant.save(out, format='PNG', optimize=True)
+        contentType = 'image/png'
+    else:
+        variant.convert('RGB').save(out, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        contentType = 'image/jpeg'
+    return out.getvalue(), contentType
+
+# This makes all of the variants for an image and returns them in a dictionary like
+# {'thumb': (bytes, 'image/jpeg'), ...}
+def makeVariants(img):
+    return {name: makeVariant(img, size) for name, size in VARIANTS.items()}
+
+def _gridFS(doc, fieldName):
+    field = doc._fields[fieldName]
+    return gridfs.GridFS(get_db(field.db_alias), field.collection_name)
+
+# This copies stream in to a new GridFS file for doc.<fieldName> a chunk at a time and
+# returns the new file's id. The document isn't changed. If the stream is bigger than
+# maxBytes the part that was written is removed and a ValueError is raised.
+def writeGridFile(doc, fieldName, stream, contentType, maxBytes=None):
+    gridIn = _gridFS(doc, fieldName).new_file(content_type=contentType, chunk_size=CHUNK_SIZE)
+    total = 0
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if maxBytes and total > maxBytes:
+                raise ValueError(f'The uploaded image is bigger than {maxBytes // (1024 * 1024)} MB.')
+            gridIn.write(chunk)
+    except BaseException:
+        gridIn.abort()
+        raise
+    gridIn.close()
+    return gridIn._id
+
+# This points doc at the new GridFS files in newFiles ({fieldName: fileId}) with one save
+# and then deletes the files it used to point at.
+def swapGridFiles(doc, newFiles):
+    oldFiles = []
+    for fieldName, fileID in newFiles.items():
+        field = doc._fields[fieldName]
+        old = getattr(doc, fieldName)
+        if old and old.grid_id:
+            oldFiles.append((fieldName, old.grid_id))
+        setattr(doc, fieldName, GridFSProxy(grid_id=fileID, key=fieldName, instance=doc,
+                                            db_alias=field.db_alias, collection_name=field.collection_name))
+    doc.save()
+    for fieldName, fileID in oldFiles:
+        _gridFS(doc, fieldName).delete(fileID)
+
+# This stores the variants of img as new GridFS files and returns {fieldName: fileId}
+def writeVariants(doc, img):
+    return {'image_' + name: writeGridFile(doc, 'image_' + name, BytesIO(data), contentType)
+            for name, (data, contentType) in makeVariants(img).items()}
+
+# This is the function the routes call when a user uploads an image. upload is the
+# file from the form (or any file object). It checks that it really is an image,
+# streams the original in to GridFS with its real content type, makes the variants
+# and then saves doc pointing at all of them.
+def saveImage(doc, upload):
+    stream = getattr(upload, 'stream', upload)
+    # uploads bigger than a few hundred KB are kept in a temporary file, not in memory,
+    # so jumping to the end tells us the size without reading it
+    stream.seek(0, 2)
+    maxBytes = app.config['MAX_IMAGE_BYTES']
+    if stream.tell() > maxBytes:
+        raise ValueError(f'The uploaded image is bigger than {maxBytes // (1024 * 1024)} MB.')
+    stream.seek(0)
+    contentType = sniffContentType(stream.read(16))
+    if not contentType:
+        raise ValueError('The uploaded file is not a jpeg, png, gif or webp image.')
+    stream.seek(0)
+    img = openImage(stream, draftSize=max(VARIANTS.values()))
+    stream.seek(0)
+    newFiles = {}
+    try:
+        newFiles['image'] = writeGridFile(doc, 'image', stream, contentType, maxBytes)
+        newFiles.update(writeVariants(doc, img))
+    except BaseException:
+        # don't leave half of an upload behind
+        for fieldName, fileID in newFiles.items():
+            _gridFS(doc, fieldName).delete(fileID)
+        raise
+    swapGridFiles(doc, newFiles)
+
+# This makes the variants for a document that has an image that was uploaded before
+# variants existed.  It is used by the 'flask images backfill' command.
+def backfillImage(doc):
+    img = openImage(doc.image.get(), draftSize=max(VARIANTS.values()))
+    swapGridFiles(doc, writeVariants(doc, img))
+
+# This deletes all of the stored image files of a document. Call it after deleting the document.
+def deleteImages(doc):
+    for fieldName in ('image',) + tuple('image_' + name for name in VARIANTS):
+        stored = getattr(doc, fieldName)
+        if stored and stored.grid_id:
+            _gridFS(doc, fieldName).delete(stored.grid_id)
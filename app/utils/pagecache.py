@@ -0,0 +1,74 @@
+# Most of the pages in default.py and quiz.py are the same for every visitor who isn't
+# logged in. Instead of running the template every time, renderStatic() renders each
+# page once, keeps the html in memory and sends that copy.  The browser is also given
+# an 'ETag' (a fingerprint of the page) so when it asks again with that fingerprint we
+# can answer '304 Not Modified' without sending the page at all.
+#
+# The cache is emptied automatically when any file in the templates folder changes, or
+# when 'flask assets build' writes a new manifest (the pages link to the built files by
+# their fingerprinted names, see app/utils/assets.py).
+# Logged in users (whose navbar shows their username) and requests with flashed
+# messages waiting always get a freshly rendered page.
+
+import hashlib
+import os
+import threading
+import time
+from flask import render_template, request, session
+from flask_login import current_user
+from app import app
+from app.utils.assets import manifestVersion
+
+# How often (in seconds) to look at the template files to see if they changed.
+app.config.setdefault('PAGE_CACHE_CHECK_INTERVAL', 2)
+
+_pages = {}
+_lock = threading.Lock()
+_version = None
+_checkedAt = 0
+
+# This is a fingerprint of the templates folder: the newest change time and the number of files.
+def templatesVersion():
+    newest = 0
+    count = 0
+    for folder, dirs, files in os.walk(app.jinja_loader.searchpath[0]):
+        for name in files:
+            newest = max(newest, os.stat(os.path.join(folder, name)).st_mtime_ns)
+            count += 1
+    return newest, count
+
+# This empties the cache if the templates or the asset manifest changed since the last check
+def _checkVersion():
+    global _version, _checkedAt
+    now = time.monotonic()
+    if now - _checkedAt < app.config['PAGE_CACHE_CHECK_INTERVAL']:
+        return
+    version = (templatesVersion(), manifestVersion())
+    with _lock:
+        _checkedAt = now
+        if version != _version:
+            _version = version
+            _pages.clear()
+
+def _makeResponse(html, etag):
+    rv = app.response_class(html, mimetype='text/html')
+    rv.set_etag(etag)
+    # The page is different for logged in users so the browser must check with us every
+    # time and shared caches must not give one user's copy to another.
+    rv.cache_control.no_cache = True
+    rv.vary.add('Cookie')
+    return rv.make_conditional(request)
+
+# Use this in place of render_template() for a page that doesn't use any variables.
+def renderStatic(templateName):
+    if not current_user.is_anonymous or '_flashes' in session:
+        html = render_template(templateName)
+        return _makeResponse(html, hashlib.sha1(html.encode('utf-8')).hexdigest())
+    _checkVersion()
+    page = _pages.get(templateName)
+    if page is None:
+        html = render_template(templateName).encode('utf-8')
+        page = (html, hashlib.sha1(html).hexdigest())
+        with _lock:
+            _pages[templateName] = page
+    return _makeResponse(*page)
@@ -0,0 +1,172 @@
+# Checking a password means hashing it, which is slow ON PURPOSE so that someone who
+# steals the database can't quickly guess passwords.  Each hash keeps a CPU busy for
+# a while, so if lots of people (or a program guessing passwords) log in at once the
+# hashes would use up every CPU and all other pages would get slow.
+#
+# To stop that, hashing is done by a small pool of background threads
+# (PASSWORD_HASH_WORKERS per web server process).  Python's hashlib lets other threads
+# run while it hashes, so the request thread just waits for the answer.  At most
+# PASSWORD_HASH_MAX_WAITING more hashes can wait in line. If there is no room, or the
+# answer takes longer than PASSWORD_HASH_TIMEOUT seconds, PasswordBusy is raised and
+# the user is asked to try again.
+#
+# The hash settings can be changed with PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH.
+# Passwords stored with old settings are hashed again with the new ones the next time
+# the user logs in (see needsRehash()).
+#
+# throttle() stops an IP address or a username after too many failed logins, so one
+# visitor guessing passwords can't keep the pool busy. Only failures are counted
+# (loginFailed()), so a school or office where everyone shares one address isn't locked
+# out by people who type their password right. Registering and resetting a password
+# hash every time, so each one counts against the address (countAttempt()).
+# The address is request.remote_addr. Behind a load balancer or proxy that is the
+# proxy's address unless PROXY_COUNT is set (see app/__init__.py).
+#
+# The counters are kept in memory, so each web server process has its own and they
+# start over when it restarts. With gunicorn's 'workers' processes a visitor can get
+# up to workers x THROTTLE_PER_IP tries before every process has stopped them.
+# THROTTLE_ENABLED=0 in the environment turns the throttle off, for benchmarks only.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from cachetools import TTLCache
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from app import app
+
+app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+app.config.setdefault('PASSWORD_SALT_LENGTH', 16)
+app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+app.config.setdefault('PASSWORD_HASH_MAX_WAITING', 16)
+app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+# Attempts allowed in each THROTTLE_WINDOW seconds
+app.config.setdefault('THROTTLE_WINDOW', 300)
+app.config.setdefault('THROTTLE_PER_IP', 30)
+app.config.setdefault('THROTTLE_PER_USER', 10)
+app.config.setdefault('THROTTLE_ENABLED', os.environ.get('THROTTLE_ENABLED', '1') != '0')
+
+class PasswordBusy(Exception):
+    pass
+
+_pool = None
+_slots = None
+# The id of the process that made the pool. Threads don't survive a fork so a new web
+# server process has to make its own (the same as the mail workers in routes/mail.py).
+_poolPid = None
+_lock = threading.Lock()
+
+def _getPool():
+    global _pool, _slots, _poolPid
+    with _lock:
+        if _poolPid != os.getpid():
+            workers = app.config['PASSWORD_HASH_WORKERS']
+            _pool = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_MAX_WAITING'])
+            _poolPid = os.getpid()
+        return _pool, _slots
+
+# This runs function(*args) on the pool and returns its answer
+def _run(function, *args):
+    pool, slots = _getPool()
+    timeout = app.config['PASSWORD_HASH_TIMEOUT']
+    deadline = time.monotonic() + timeout
+    if not slots.acquire(timeout=timeout):
+        raise PasswordBusy()
+    try:
+        future = pool.submit(function, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # the slot is given back when the hash is finished, even if nobody waits for it anymore
+    future.add_done_callback(lambda f: slots.release())
+    try:
+        return future.result(timeout=max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        # if it hasn't started yet it never will
+        future.cancel()
+        raise PasswordBusy()
+
+# PASSWORD_HASH_METHOD with the number of pbkdf2 rounds filled in, the way it is stored
+def _method():
+    method = app.config['PASSWORD_HASH_METHOD']
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        method += f':{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+def hashPassword(password):
+    return _run(generate_password_hash, password, _method(), app.config['PASSWORD_SALT_LENGTH'])
+
+def checkPassword(pwhash, password):
+    if not pwhash:
+        return False
+    return _run(check_password_hash, pwhash, password)
+
+# This hashes many passwords at once for 'flask users import'. It uses its own threads
+# (one per CPU unless workers is given) instead of the pool above, which is kept for
+# web requests.
+def hashPasswords(passwords, workers=None):
+    method = _method()
+    saltLength = app.config['PASSWORD_SALT_LENGTH']
+    with ThreadPoolExecutor(workers or os.cpu_count()) as pool:
+        return list(pool.map(lambda password: generate_password_hash(password, method, saltLength), passwords))
+
+# A stored hash looks like 'pbkdf2:sha256:260000$<salt>$<hash>'. This returns True if
+# it was made with different settings than the current ones.
+def needsRehash(pwhash):
+    if not pwhash or pwhash.count('$') < 2:
+        return True
+    method, salt, _ = pwhash.split('$', 2)
+    return method != _method() or len(salt) != app.config['PASSWORD_SALT_LENGTH']
+
+# {key: [windowStart, attempts]}. Old keys fall out of the cache by themselves.
+_attempts = TTLCache(maxsize=100000, ttl=app.config['THROTTLE_WINDOW'])
+_attemptsLock = threading.Lock()
+
+def _key(kind, value):
+    return f'{kind}:{value}'.lower()
+
+def _current(key, now):
+    entry = _attempts.get(key)
+    if entry is None or now - entry[0] >= app.config['THROTTLE_WINDOW']:
+        return None
+    return entry
+
+def _over(key, limit, now):
+    entry = _current(key, now)
+    return entry is not None and entry[1] >= limit
+
+def _add(key, now):
+    entry = _current(key, now) or [now, 0]
+    entry[1] += 1
+    _attempts[key] = entry
+
+# This returns False if ip or username has failed too many times. Call it before
+# checking a password. It doesn't count anything itself.
+def throttle(ip, username=None):
+    if not app.config['THROTTLE_ENABLED']:
+        return True
+    now = time.monotonic()
+    with _attemptsLock:
+        if username and _over(_key('user', username), app.config['THROTTLE_PER_USER'], now):
+            return False
+        return not _over(_key('ip', ip), app.config['THROTTLE_PER_IP'], now)
+
+# Call this after a wrong password or a username that doesn't exist
+def loginFailed(ip, username):
+    now = time.monotonic()
+    with _attemptsLock:
+        _add(_key('ip', ip), now)
+        _add(_key('user', username), now)
+
+# Call this when a password is hashed for something other than a login (registering
+# or resetting a password)
+def countAttempt(ip):
+    with _attemptsLock:
+        _add(_key('ip', ip), time.monotonic())
+
+# Call this after a correct password so earlier mistakes with this username are
+# forgotten. The address keeps its count because it may be guessing other usernames.
+def loginSucceeded(username):
+    with _attemptsLock:
+        _attempts.pop(_key('user', username), None)
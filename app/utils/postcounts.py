@@ -0,0 +1,40 @@
+# This recalculates the comment counts that are stored on each Post (commentcount,
+# lastcomment and lastactivity) from the comments themselves. It is used by the
+# 'flask posts repair-counts' command, for example after comments were imported in bulk
+# which doesn't send the signals that normally keep the counts up to date.
+
+from pymongo import UpdateOne
+from app.classes.data import Post, Comment
+
+# Posts are read batchSize at a time and MongoDB counts the comments for the whole
+# batch with one aggregation that uses the post + createdate index.
+def repairPostCounts(batchSize=1000):
+    posts = Post._get_collection()
+    comments = Comment._get_collection()
+    repaired = 0
+    batch = []
+    for post in posts.find({}, {'createdate': 1}).sort('_id', 1).batch_size(batchSize):
+        batch.append(post)
+        if len(batch) >= batchSize:
+            repaired += _repairBatch(posts, comments, batch)
+            batch = []
+    if batch:
+        repaired += _repairBatch(posts, comments, batch)
+    return repaired
+
+def _repairBatch(posts, comments, batch):
+    counts = {row['_id']: row for row in comments.aggregate([
+        {'$match': {'post': {'$in': [post['_id'] for post in batch]}}},
+        {'$group': {'_id': '$post', 'count': {'$sum': 1}, 'last': {'$max': '$createdate'}}},
+    ])}
+    updates = []
+    for post in batch:
+        row = counts.get(post['_id'], {'count': 0, 'last': None})
+        dates = [d for d in (post.get('createdate'), row['last']) if d]
+        updates.append(UpdateOne({'_id': post['_id']}, {'$set': {
+            'commentcount': row['count'],
+            'lastcomment': row['last'],
+            'lastactivity': max(dates) if dates else None,
+        }}))
+    posts.bulk_write(updates, ordered=False)
+    return len(updates)
@@ -0,0 +1,175 @@
+# The story game is made of StoryPages that point to each other with their c1 and c2
+# choices, which makes a 'graph'. This file keeps a small copy of that graph in memory:
+# just the title, the two choices and the image ids of every page. Pages can then show
+# their choices without asking the database for each one.
+#
+# When a page is created, edited or deleted (see story.py) only that page is changed in
+# the copy. The whole copy is also rebuilt after STORY_GRAPH_TTL seconds so other web
+# server processes catch up with changes made in this one.
+#
+# The graph also keeps a sorted list of titles so the page form can search for a choice
+# by the first few letters of its title instead of listing every page.
+
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from app import app
+from app.classes.data import StoryPage
+
+app.config.setdefault('STORY_GRAPH_TTL', 60)
+# The page each story starts on. '/page/start' uses 'default' and '/page/start/<story>'
+# uses the others.  If a start page is missing the first page nothing points to is used.
+app.config.setdefault('STORY_START_PAGES', {'default': '6269746f15559196d7dc660d'})
+
+NODE_FIELDS = ('title', 'c1', 'c2', 'image', 'image_thumb', 'image_card', 'image_full')
+
+def _toObjectId(value):
+    # ObjectId(None) would make a brand new id so None has to be checked first
+    if value is None:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+def _titleKey(son):
+    return ((son.get('title') or '').lower(), son['_id'])
+
+class StoryGraph:
+    def __init__(self, sons, builtAt=None):
+        # nodes looks like {pageId: {'_id': ..., 'title': ..., 'c1': ..., 'c2': ...}}
+        self.nodes = {son['_id']: son for son in sons}
+        # titles looks like [('a dark forest', pageId), ...] sorted so that bisect can find prefixes
+        self.titles = sorted(_titleKey(son) for son in self.nodes.values())
+        self.builtAt = builtAt or time.monotonic()
+
+    # A graph is never changed after it is made because other requests may be reading it.
+    # These two return a new graph with one page added/replaced or removed.  Only the
+    # dictionary and list are copied, the pages themselves are shared.
+    def withPage(self, son):
+        graph = self.withoutPage(son['_id'])
+        graph.nodes[son['_id']] = son
+        insort(graph.titles, _titleKey(son))
+        return graph
+
+    def withoutPage(self, pageID):
+        graph = StoryGraph([], self.builtAt)
+        graph.nodes = dict(self.nodes)
+        graph.titles = list(self.titles)
+        old = graph.nodes.pop(pageID, None)
+        if old is not None:
+            i = bisect_left(graph.titles, _titleKey(old))
+            if i < len(graph.titles) and graph.titles[i] == _titleKey(old):
+                del graph.titles[i]
+        return graph
+
+    # This returns up to 'limit' (id, title) pairs for pages whose title starts with prefix
+    def searchTitles(self, prefix, limit=20):
+        prefix = prefix.lower()
+        results = []
+        i = bisect_left(self.titles, (prefix,))
+        while i < len(self.titles) and len(results) < limit and self.titles[i][0].startswith(prefix):
+            pageID = self.titles[i][1]
+            results.append((pageID, self.nodes[pageID].get('title')))
+            i += 1
+        return results
+
+    def title(self, pageID):
+        return self.nodes.get(_toObjectId(pageID), {}).get('title')
+
+    # This returns a StoryPage that only has NODE_FIELDS filled in, or None
+    def page(self, pageID):
+        son = self.nodes.get(_toObjectId(pageID))
+        if son is None:
+            return None
+        return StoryPage._from_son(dict(son), only_fields=NODE_FIELDS)
+
+    # This returns the two choice pages of a page (either can be None)
+    def choices(self, pageID):
+        son = self.nodes.get(_toObjectId(pageID), {})
+        return self.page(son.get('c1')), self.page(son.get('c2'))
+
+    def edges(self, pageID):
+        son = self.nodes.get(pageID, {})
+        return [son[c] for c in ('c1', 'c2') if son.get(c)]
+
+    # Pages that no other page points to
+    def roots(self):
+        pointedTo = {child for pageID in self.nodes for child in self.edges(pageID)}
+        return [pageID for pageID in self.nodes if pageID not in pointedTo]
+
+    # This returns the id of the first page of a story from STORY_START_PAGES
+    def startPage(self, story='default'):
+        pageID = _toObjectId(app.config['STORY_START_PAGES'].get(story))
+        if pageID in self.nodes:
+            return pageID
+        roots = self.roots()
+        return roots[0] if roots else None
+
+    # All of the pages that can be reached by following choices from the start pages
+    def reachable(self, startIDs):
+        seen = set()
+        todo = deque(pageID for pageID in startIDs if pageID in self.nodes)
+        while todo:
+            pageID = todo.popleft()
+            if pageID in seen:
+                continue
+            seen.add(pageID)
+            todo.extend(child for child in self.edges(pageID) if child in self.nodes)
+        return seen
+
+    # Choices that point to a page that doesn't exist anymore: [(pageId, 'c1', missingId), ...]
+    def dangling(self):
+        return [(pageID, c, son[c]) for pageID, son in self.nodes.items()
+                for c in ('c1', 'c2') if son.get(c) and son[c] not in self.nodes]
+
+    # A summary of the graph that is used by the 'flask story report' command
+    def report(self):
+        starts = {story: self.startPage(story) for story in app.config['STORY_START_PAGES']}
+        reachable = self.reachable([pageID for pageID in starts.values() if pageID])
+        return {
+            'pages': len(self.nodes),
+            'startPages': starts,
+            'reachable': len(reachable),
+            'unreachable': [pageID for pageID in self.nodes if pageID not in reachable],
+            'dangling': self.dangling(),
+        }
+
+_graph = None
+_lock = threading.Lock()
+
+# This returns the in memory graph and builds it with one query if it is missing or old
+def getStoryGraph():
+    global _graph
+    graph = _graph
+    if graph is None or time.monotonic() - graph.builtAt > app.config['STORY_GRAPH_TTL']:
+        with _lock:
+            # another request may have rebuilt it while this one was waiting for the lock
+            if _graph is None or _graph is graph:
+                _graph = StoryGraph(StoryPage.objects.only(*NODE_FIELDS).as_pymongo())
+            graph = _graph
+    return graph
+
+# Call this after a StoryPage is created or changed
+def updateStoryPage(pageID):
+    global _graph
+    son = StoryPage.objects(pk=pageID).only(*NODE_FIELDS).as_pymongo().first()
+    with _lock:
+        if _graph is not None and son is not None:
+            _graph = _graph.withPage(son)
+
+# Call this after a StoryPage is deleted
+def removeStoryPage(pageID):
+    global _graph
+    with _lock:
+        if _graph is not None:
+            _graph = _graph.withoutPage(_toObjectId(pageID))
+
+# This throws away the whole copy so the next request rebuilds it
+def invalidateStoryGraph():
+    global _graph
+    with _lock:
+        _graph = None
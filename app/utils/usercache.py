@@ -0,0 +1,42 @@
+# Flask-Login calls load_user() (see login.py) at the start of every request from a
+# logged in user to find out who they are.  Instead of asking MongoDB every time, this
+# keeps a small copy of each recently seen user in memory for a short time.
+# Flask-Login already remembers the user for the rest of a single request so this
+# cache is what saves the database trip on the NEXT request.
+#
+# Each web server process has its own cache, so after a change in one process the
+# other processes can show old data for at most USER_CACHE_TTL seconds.
+
+from threading import Lock
+from cachetools import TTLCache
+from app import app
+from app.classes.data import User
+
+app.config.setdefault('USER_CACHE_SIZE', 1024)
+app.config.setdefault('USER_CACHE_TTL', 60)
+
+# The user fields that pages need for current_user. The password hash is left out on purpose.
+USER_FIELDS = ('username', 'fname', 'lname', 'email', 'role', 'image', 'image_thumb', 'image_card', 'image_full')
+
+_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+_lock = Lock()
+
+# This returns a User with just USER_FIELDS filled in, or None if there is no such user.
+# The cache stores the raw data and a new User object is made for every request so
+# that two requests never share (and change) the same object.
+def getUser(userID):
+    key = str(userID)
+    with _lock:
+        son = _cache.get(key)
+    if son is None:
+        son = User.objects(pk=userID).only(*USER_FIELDS).as_pymongo().first()
+        if son is None:
+            return None
+        with _lock:
+            _cache[key] = son
+    return User._from_son(dict(son), only_fields=USER_FIELDS)
+
+# Call this after changing a user so the next request gets the new data.
+def invalidateUser(userID):
+    with _lock:
+        _cache.pop(str(userID), None)
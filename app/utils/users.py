@@ -0,0 +1,67 @@
+# Helpers for creating users.  The username and email indexes in data.py are 'unique',
+# so MongoDB itself refuses a second user with the same username or email.  Instead of
+# asking the database 'is this username taken?' before saving (which takes an extra
+# trip and can still let two people who sign up at the same moment both through),
+# the user is just inserted and a 'duplicate key' error is turned in to a form error.
+#
+# That only works once the unique indexes exist. They are made by 'flask db indexes'
+# (data.py turns auto_create_index off), which is a required step when deploying.
+# /readyz calls missingUniqueIndexes() and refuses traffic until it has been run.
+
+import re
+from pymongo.errors import BulkWriteError
+from app.classes.data import User
+
+# The fields that have a unique index and the message shown when one is taken
+UNIQUE_FIELDS = {
+    'username': 'this username is taken.',
+    'email': 'this email address is already in use. if you have forgotten your credentials you can try to recover your account.',
+}
+
+# MongoDB's error message names the index, for example
+#   E11000 duplicate key error collection: capstone.user index: username_1 dup key: ...
+INDEX_NAME = re.compile(r'index: (\w+?)_-?1\b')
+
+# This returns the field ('username' or 'email') that a duplicate key error is about,
+# or None if it can't tell.  error is a NotUniqueError or the message of one write error.
+def duplicateField(error):
+    match = INDEX_NAME.search(str(error))
+    if match and match.group(1) in UNIQUE_FIELDS:
+        return match.group(1)
+    return None
+
+# This inserts many new users with one round-trip.  users is a list of unsaved User
+# objects.  Users that break a unique index are skipped and the others are still
+# inserted ('ordered=False').  It returns the number inserted and a list of
+# (position in users, field) for the ones that were skipped.
+def insertUsers(users):
+    if not users:
+        return 0, []
+    collection = User._get_collection()
+    try:
+        result = collection.insert_many([user.to_mongo() for user in users], ordered=False)
+    except BulkWriteError as e:
+        skipped = []
+        for writeError in e.details['writeErrors']:
+            # 11000 is MongoDB's code for a duplicate key, anything else is a real problem
+            if writeError['code'] != 11000:
+                raise
+            skipped.append((writeError['index'], duplicateField(writeError['errmsg'])))
+        return e.details['nInserted'], skipped
+    return len(result.inserted_ids), []
+
+# The unique indexes don't go away once they are made, so after they have been found
+# once this process stops asking
+_uniqueIndexesFound = False
+
+# This returns the UNIQUE_FIELDS that don't have a unique index yet (an empty list if
+# they all do)
+def missingUniqueIndexes():
+    global _uniqueIndexesFound
+    if _uniqueIndexesFound:
+        return []
+    indexes = User._get_collection().index_information()
+    unique = {index['key'][0][0] for index in indexes.values() if index.get('unique') and len(index['key']) == 1}
+    missing = [field for field in UNIQUE_FIELDS if field not in unique]
+    _uniqueIndexesFound = not missing
+    return missing
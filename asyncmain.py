@@ -0,0 +1,15 @@
+# This starts the async read server (see app/asyncread/__init__.py) next to the Flask
+# site that main.py starts. For real traffic run it with gunicorn and aiohttp's worker:
+#     gunicorn asyncmain:app --worker-class aiohttp.GunicornWebWorker --bind 127.0.0.1:8001
+# Each worker is one process with one thread, so WEB_CONCURRENCY (the number of
+# workers) is usually the number of CPUs. It reads the same settings as the Flask
+# site, including FLASK_SECRET_KEY and MONGO_HOST.
+
+import os
+from aiohttp import web
+from app.asyncread import createAsyncApp
+
+app = createAsyncApp()
+
+if __name__ == "__main__":
+    web.run_app(app, host='127.0.0.1', port=int(os.environ.get('ASYNC_PORT', 8001)))
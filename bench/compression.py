@@ -0,0 +1,72 @@
+# Measures how much response compression saves on the main pages and how much CPU
+# it costs.  See bench/readme.txt
+
+import argparse
+import random
+import time
+from app import app
+from app.classes.data import Post, StoryPage
+from app.utils.compression import COMPRESSORS, compressionStats
+from bench.seed import useDatabase, seed, PASSWORD
+from bench.run import STATIC_ROUTES
+
+# 'identity' means 'don't compress', which is the baseline
+ENCODINGS = ['identity'] + [name for name in ('gzip', 'br') if name in COMPRESSORS]
+
+def routes():
+    result = {'static': STATIC_ROUTES, 'postList': ['/post/list']}
+    postIds = [str(p['_id']) for p in Post.objects.only('id').limit(50).as_pymongo()]
+    pageIds = [str(p['_id']) for p in StoryPage.objects.only('id').limit(50).as_pymongo()]
+    if postIds:
+        result['post'] = ['/post/' + postID for postID in postIds]
+    if pageIds:
+        result['page'] = ['/page/' + pageID for pageID in pageIds]
+    return result
+
+# This requests each path 'count' times with one Accept-Encoding and returns the
+# average body size, the average CPU time of a whole request and the average CPU time
+# spent compressing
+def measure(client, paths, encoding, count):
+    before = compressionStats()
+    size = 0
+    cpu = 0.0
+    for i in range(count):
+        path = random.choice(paths)
+        start = time.process_time()
+        rv = client.get(path, headers={'Accept-Encoding': encoding})
+        size += len(rv.get_data())
+        cpu += time.process_time() - start
+    after = compressionStats()
+    return {
+        'bytes': size // count,
+        'cpuMs': round(cpu * 1000 / count, 3),
+        'compressMs': round((after['seconds'] - before['seconds']) * 1000 / count, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure response compression.')
+    parser.add_argument('--db', default='capstone_bench')
+    parser.add_argument('--host', help='MongoDB url, default mongodb://localhost:27017')
+    parser.add_argument('--mongomock', action='store_true', help='seed and use an in-memory stand-in')
+    parser.add_argument('--requests', type=int, default=100, help='requests per route and encoding')
+    args = parser.parse_args()
+
+    useDatabase(args.db, args.host, args.mongomock)
+    if args.mongomock:
+        seed(users=50, posts=1000, comments=5, pages=100, imageShare=0.5, batchSize=500)
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench0', 'password': PASSWORD})
+
+    print(f"{'route':10} {'encoding':9} {'bytes':>9} {'saved':>7} {'cpu ms':>8} {'compress ms':>12}")
+    for name, paths in routes().items():
+        baseline = None
+        for encoding in ENCODINGS:
+            random.seed(1)
+            r = measure(client, paths, encoding, args.requests)
+            baseline = baseline or r['bytes']
+            saved = 1 - r['bytes'] / baseline if baseline else 0
+            print(f"{name:10} {encoding:9} {r['bytes']:9} {saved:7.1%} {r['cpuMs']:8.3f} {r['compressMs']:12.3f}")
+
+if __name__ == '__main__':
+    main()
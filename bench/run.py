@@ -0,0 +1,233 @@
+# Sends many requests at once to the main routes and reports how fast they were.
+# See bench/readme.txt
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+from app.classes.data import User, Post, StoryPage
+from bench.seed import useDatabase, seed, PASSWORD
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines')
+STATIC_ROUTES = ['/', '/aboutus', '/mentalhealth', '/quiz', '/happy', '/sad']
+DB_COMMANDS = re.compile(r'db;dur=[\d.]+;desc="(\d+) commands"')
+
+# Every status from 300 up counts as an error, because a redirect usually means the
+# client was sent back to /login instead of getting the page. A correct login is the
+# one redirect that is expected, so it is turned in to 200 here. A wrong password
+# (redirected back to /login) or a throttled login (429) stays an error.
+def loginStatus(status, location):
+    if status == 302 and '/login' not in location:
+        return 200
+    return status
+
+# A client that calls the Flask app directly in this process
+class AppClient:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def fresh(self):
+        return AppClient()
+
+    def get(self, path):
+        rv = self.client.get(path)
+        return rv.status_code, rv.headers.get('Server-Timing', '')
+
+    def login(self, username, password):
+        rv = self.client.post('/login', data={'username': username, 'password': password})
+        return loginStatus(rv.status_code, rv.headers.get('Location', '')), rv.headers.get('Server-Timing', '')
+
+# A client that talks to a running server over http(s)
+# loginURL is the server that logs the client in, if it isn't url. The async read
+# server (asyncmain.py) has no login page so the Flask site does it.
+class HTTPClient:
+    def __init__(self, url, loginURL=None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.url = url.rstrip('/')
+        self.loginURL = (loginURL or url).rstrip('/')
+        self.session = requests.Session()
+        self.session.verify = False
+        # The server closes a kept-alive connection that was idle for longer than its
+        # keepalive (gunicorn.conf.py), for example between two scenarios. A GET that
+        # finds its connection closed is sent again once on a new one.
+        for prefix in ('http://', 'https://'):
+            self.session.mount(prefix, HTTPAdapter(max_retries=Retry(total=1, status=0, redirect=0)))
+
+    def fresh(self):
+        return HTTPClient(self.url, self.loginURL)
+
+    def get(self, path):
+        rv = self.session.get(self.url + path, allow_redirects=False)
+        return rv.status_code, rv.headers.get('Server-Timing', '')
+
+    def login(self, username, password):
+        page = self.session.get(self.loginURL + '/login').text
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page)
+        data = {'username': username, 'password': password, 'csrf_token': token.group(1) if token else ''}
+        rv = self.session.post(self.loginURL + '/login', data=data, allow_redirects=False)
+        return loginStatus(rv.status_code, rv.headers.get('Location', '')), rv.headers.get('Server-Timing', '')
+
+    # The most MongoDB connections the worker that answers has had open, from /metrics.
+    # None if the server doesn't have METRICS_ENABLED.
+    def connections(self):
+        rv = self.session.get(self.url + '/metrics')
+        if rv.status_code != 200:
+            return None
+        return rv.json().get('connections', {}).get('peak')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# This runs one scenario: every client calls request() 'count' times in total
+def runScenario(name, clients, request, count):
+    latencies = []
+    dbCommands = []
+    errors = 0
+    lock = threading.Lock()
+    queue = list(range(count))
+
+    def work(client):
+        nonlocal errors
+        while True:
+            with lock:
+                if not queue:
+                    return
+                queue.pop()
+            start = time.perf_counter()
+            status, timing = request(client)
+            ms = (time.perf_counter() - start) * 1000
+            match = DB_COMMANDS.search(timing)
+            with lock:
+                latencies.append(ms)
+                if match:
+                    dbCommands.append(int(match.group(1)))
+                if status >= 300:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        list(pool.map(work, clients))
+    seconds = time.perf_counter() - start
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / seconds, 1),
+        'p50': round(percentile(latencies, 50), 2),
+        'p95': round(percentile(latencies, 95), 2),
+        'p99': round(percentile(latencies, 99), 2),
+        'dbCommands': round(statistics.mean(dbCommands), 2) if dbCommands else None,
+    }
+
+# The scenarios that are run by clients that aren't logged in. Everything else uses
+# logged in clients.
+ANONYMOUS_SCENARIOS = {'staticAnonymous'}
+
+# The users made by bench/seed.py, who all have the password PASSWORD
+def seededUsers():
+    return [u['username'] for u in User.objects(__raw__={'username': {'$regex': r'^bench\d+$'}}).only('username').as_pymongo()]
+
+def scenarios(users):
+    postIds = [str(p['_id']) for p in Post.objects.only('id').limit(500).as_pymongo()]
+    pageIds = [str(p['_id']) for p in StoryPage.objects.only('id').limit(500).as_pymongo()]
+    imagePageIds = [str(p['_id']) for p in StoryPage.objects(image__ne=None).only('id').limit(500).as_pymongo()]
+    result = {
+        # logged in users always get a freshly rendered page
+        'static': lambda c: c.get(random.choice(STATIC_ROUTES)),
+        # visitors who aren't logged in get the copy kept by app/utils/pagecache.py
+        'staticAnonymous': lambda c: c.get(random.choice(STATIC_ROUTES)),
+        'postList': lambda c: c.get('/post/list'),
+        # a new client each time because a logged in client is just redirected away from /login
+        'login': lambda c: c.fresh().login(random.choice(users), PASSWORD),
+    }
+    if postIds:
+        result['post'] = lambda c: c.get('/post/' + random.choice(postIds))
+    if pageIds:
+        result['page'] = lambda c: c.get('/page/' + random.choice(pageIds))
+        result['pages'] = lambda c: c.get('/pages')
+    if imagePageIds:
+        result['image'] = lambda c: c.get(f'/image/page/{random.choice(imagePageIds)}/card')
+    return result
+
+def compare(results, baseline, tolerance):
+    failed = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before and now['p95'] > before['p95'] * (1 + tolerance):
+            failed.append(f"{name}: p95 {before['p95']}ms -> {now['p95']}ms")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the main routes.')
+    parser.add_argument('--db', default='capstone_bench')
+    parser.add_argument('--host', help='MongoDB url, default mongodb://localhost:27017')
+    parser.add_argument('--mongomock', action='store_true', help='seed and use an in-memory stand-in')
+    parser.add_argument('--url', help='benchmark a running server instead of the app in this process')
+    parser.add_argument('--login-url', help='log in on this server instead of --url (for the async read server)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--only', nargs='*', help='only run these scenarios')
+    parser.add_argument('--save', metavar='NAME', help='save the results as bench/baselines/NAME.json')
+    parser.add_argument('--compare', metavar='NAME', help='compare with bench/baselines/NAME.json')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    random.seed(1)
+    useDatabase(args.db, args.host, args.mongomock)
+    if args.mongomock:
+        seed(users=50, posts=1000, comments=5, pages=100, imageShare=0.5, batchSize=500)
+    if not args.url:
+        # The test client can't read the csrf token from the login form
+        app.config['WTF_CSRF_ENABLED'] = False
+        # every benchmark login comes from the same address
+        app.config['THROTTLE_ENABLED'] = False
+    users = seededUsers()
+    if not users:
+        raise SystemExit(f'There are no benchmark users in {args.db}. Run bench.seed first (see bench/readme.txt).')
+
+    clients = []
+    anonymous = []
+    for i in range(args.concurrency):
+        anonymous.append(HTTPClient(args.url, args.login_url) if args.url else AppClient())
+        client = HTTPClient(args.url, args.login_url) if args.url else AppClient()
+        # each client logs in once and keeps its cookie for every scenario
+        status, timing = client.login(random.choice(users), PASSWORD)
+        if status != 200:
+            raise SystemExit(f'Benchmark login failed with status {status}.')
+        clients.append(client)
+
+    results = {}
+    for name, request in scenarios(users).items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = runScenario(name, anonymous if name in ANONYMOUS_SCENARIOS else clients, request, args.requests)
+        r = results[name]
+        if args.url:
+            r['connections'] = anonymous[0].connections()
+        print(f"{name:15} {r['throughput']:8.1f} req/s  p50 {r['p50']:7.2f}ms  p95 {r['p95']:7.2f}ms  "
+              f"p99 {r['p99']:7.2f}ms  db {r['dbCommands']}  conn {r.get('connections')}  errors {r['errors']}")
+
+    if args.save:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(os.path.join(BASELINES, args.save + '.json'), 'w') as f:
+            json.dump({'concurrency': args.concurrency, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(os.path.join(BASELINES, args.compare + '.json')) as f:
+            baseline = json.load(f)['results']
+        failed = compare(results, baseline, args.tolerance)
+        for line in failed:
+            print('SLOWER ' + line)
+        if failed:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
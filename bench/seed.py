@@ -0,0 +1,108 @@
+# Fills a benchmark database with fake data. See bench/readme.txt
+
+import argparse
+import datetime as dt
+import random
+from io import BytesIO
+from mongoengine import connect, disconnect
+from PIL import Image
+from app import app, create_app
+from app.classes.data import User, Post, Comment, StoryPage
+from app.utils.images import saveImage
+from app.utils.postcounts import repairPostCounts
+
+PASSWORD = 'bench-password'
+WORDS = ('calm breathe journal happy tired walk friend music sleep tea rain sun '
+         'school family write focus habit morning evening quiet').split()
+
+# This switches mongoengine from the site's database to the benchmark database
+def useDatabase(db, host=None, mongomock=False):
+    create_app()
+    if db == app.config.get('MONGO_DB_NAME'):
+        raise SystemExit(f'{db} is the site database. Use a separate database for benchmarks.')
+    disconnect()
+    if mongomock:
+        import mongomock.gridfs
+        mongomock.gridfs.enable_gridfs_integration()
+        host = 'mongomock://localhost'
+    connect(db, host=host or 'mongodb://localhost:27017')
+
+def sentence(n):
+    return ' '.join(random.choice(WORDS) for i in range(n))
+
+# A small jpeg so that image routes and variants have something to work with
+def fakeImage(size=800):
+    img = Image.new('RGB', (size, size), tuple(random.randrange(256) for i in range(3)))
+    out = BytesIO()
+    img.save(out, format='JPEG')
+    out.seek(0)
+    return out
+
+def insertBatches(docClass, docs, batchSize=1000):
+    ids = []
+    for i in range(0, len(docs), batchSize):
+        ids += [doc.id for doc in docClass.objects.insert(docs[i:i + batchSize])]
+    return ids
+
+def seed(users, posts, comments, pages, imageShare, batchSize):
+    for docClass in (User, Post, Comment, StoryPage):
+        docClass.drop_collection()
+    for docClass in (User, Post, Comment, StoryPage):
+        docClass.ensure_indexes()
+
+    # Hashing a password is slow on purpose so every fake user shares one hash
+    template = User()
+    template.set_password(PASSWORD)
+    userDocs = [User(username=f'bench{i}', email=f'bench{i}@example.com', fname='Bench', lname=str(i),
+                     role='learner', password_hash=template.password_hash) for i in range(users)]
+    userIds = insertBatches(User, userDocs, batchSize)
+    for userID in random.sample(userIds, int(len(userIds) * imageShare)):
+        user = User.objects.get(pk=userID)
+        saveImage(user, fakeImage())
+
+    start = dt.datetime.utcnow() - dt.timedelta(minutes=posts)
+    postDocs = [Post(author=random.choice(userIds), subject=sentence(4), content=sentence(60),
+                     review='3 stars', createdate=start + dt.timedelta(minutes=i)) for i in range(posts)]
+    postIds = insertBatches(Post, postDocs, batchSize)
+
+    commentDocs = []
+    for postID in postIds:
+        for i in range(random.randint(0, comments * 2)):
+            commentDocs.append(Comment(author=random.choice(userIds), post=postID, content=sentence(20)))
+            if len(commentDocs) >= batchSize:
+                insertBatches(Comment, commentDocs, batchSize)
+                commentDocs = []
+    insertBatches(Comment, commentDocs, batchSize)
+    # bulk inserts don't update the comment counts on the posts
+    repairPostCounts(batchSize)
+
+    pageDocs = [StoryPage(author=random.choice(userIds), title=sentence(3).title(), content=sentence(80))
+                for i in range(pages)]
+    pageIds = insertBatches(StoryPage, pageDocs, batchSize)
+    for pageID in pageIds:
+        StoryPage.objects(pk=pageID).update_one(set__c1=random.choice(pageIds), set__c2=random.choice(pageIds))
+    for pageID in random.sample(pageIds, int(len(pageIds) * imageShare)):
+        page = StoryPage.objects.get(pk=pageID)
+        saveImage(page, fakeImage())
+
+    print(f'seeded {len(userIds)} users, {len(postIds)} posts, {Comment.objects.count()} comments, {len(pageIds)} pages')
+
+def main():
+    parser = argparse.ArgumentParser(description='Fill a benchmark database with fake data.')
+    parser.add_argument('--db', default='capstone_bench')
+    parser.add_argument('--host', help='MongoDB url, default mongodb://localhost:27017')
+    parser.add_argument('--mongomock', action='store_true', help='use an in-memory stand-in instead of MongoDB')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=10, help='average comments per post')
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--image-share', type=float, default=0.5, help='fraction of users/pages that get an image')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1, help='random seed so runs are repeatable')
+    args = parser.parse_args()
+    random.seed(args.seed)
+    useDatabase(args.db, args.host, args.mongomock)
+    seed(args.users, args.posts, args.comments, args.pages, args.image_share, args.batch_size)
+
+if __name__ == '__main__':
+    main()
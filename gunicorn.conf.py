@@ -0,0 +1,53 @@
+# These are the settings for running the site with gunicorn, a web server that is made
+# for real traffic. It runs several copies ('workers') of the app at the same time and
+# each worker can answer several requests at once with 'threads'.
+#
+# Start the site with:
+#     gunicorn main:app
+# gunicorn reads this file automatically. Every setting can be changed with an
+# environment variable, for example:  WEB_CONCURRENCY=8 gunicorn main:app
+#
+# Because of preload_app (below) the code is loaded once by the master process, so
+# the HUP signal only restarts the workers with the OLD code. To switch to new code
+# without dropping requests start a second master next to the old one:
+#     kill -USR2 <old master pid>     a new master and workers start with the new code
+#     kill -WINCH <old master pid>    the old workers finish their requests and stop
+#     kill -QUIT <old master pid>     the old master stops once the new one looks fine
+# (the new master's pid is in the log, and if it doesn't work send QUIT to it instead
+# and HUP to the old master). Set FLASK_SECRET_KEY before doing this: without it each
+# master makes up its own key and everybody gets logged out.
+
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+
+# The number of worker processes. (2 x CPUs) + 1 is gunicorn's usual starting point.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threads let a worker answer other requests while one is waiting on MongoDB.
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+
+# Seconds to keep an idle browser connection open for its next request. Set this a
+# little higher than the idle timeout of any load balancer in front of the site.
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# A worker that doesn't answer for this many seconds is restarted
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+# Seconds a worker gets to finish its requests when stopping or reloading
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+
+# Restart each worker after this many requests (plus a random extra so they don't all
+# restart at once). This stops slow memory leaks from building up. 0 turns it off.
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 100))
+
+# Load the app once before forking the workers so they share memory. This is safe
+# because create_app() doesn't connect to MongoDB (see app/__init__.py).
+preload_app = True
+
+# HTTPS. Usually a load balancer does this, but cert.pem/key.pem can be used directly.
+certfile = os.environ.get('SSL_CERTFILE')
+keyfile = os.environ.get('SSL_KEYFILE')
+
+accesslog = '-'
+errorlog = '-'
@@ -1,10 +1,19 @@
-# This is the file that you run to start your app
+# This is the file that you run to start your app.
+#
+# Running this file starts Flask's own development server which is only meant for
+# working on the site. To run the site for real use gunicorn (see gunicorn.conf.py):
+#     gunicorn main:app
 
-from app import app
-# import os
+from app import create_app
+import os
+
+app = create_app()
 
 if __name__ == "__main__":
     
     #os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
     
-    app.run(debug="True", ssl_context=('cert.pem', 'key.pem'))
\ No newline at end of file
+    # The debugger lets anyone who can see an error page run python code on this computer
+    # so it is only turned on if you ask for it with: FLASK_DEBUG=1
+    debug = os.environ.get('FLASK_DEBUG') == '1'
+    app.run(debug=debug, ssl_context=('cert.pem', 'key.pem'))
@@ -0,0 +1,92 @@
+# Shared setup for the tests. Run them from the top folder with:
+#     pip install -r requirements-dev.txt
+#     python -m pytest
+# They use mongomock, an in-memory stand-in for MongoDB, so nothing has to be installed.
+# Some things (like which index a query uses) only a real MongoDB can answer. To run
+# those too set TEST_MONGO_HOST, for example TEST_MONGO_HOST=mongodb://localhost:27017
+# The tests use (and empty) the 'capstone_test' database on that server.
+
+import os
+import re
+import pytest
+from app import create_app
+
+TEST_MONGO_HOST = os.environ.get('TEST_MONGO_HOST')
+
+@pytest.fixture(scope='session')
+def app():
+    if not TEST_MONGO_HOST:
+        # mongomock doesn't have GridFS (used for pictures) unless it is turned on
+        import mongomock.gridfs
+        mongomock.gridfs.enable_gridfs_integration()
+    return create_app({
+        'MONGO_HOST': TEST_MONGO_HOST or 'mongomock://localhost',
+        'MONGO_DB_NAME': 'capstone_test',
+        'MONGO_TLS_CA_FILE': None,
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+    })
+
+# Every test that uses this starts with empty collections that have their indexes
+@pytest.fixture
+def db(app):
+    from app.classes.data import User, Post, Comment, StoryPage
+    for docClass in (User, Post, Comment, StoryPage):
+        docClass.drop_collection()
+        docClass.ensure_indexes()
+    # the uploaded pictures (GridFS)
+    database = User._get_db()
+    database.drop_collection('fs.files')
+    database.drop_collection('fs.chunks')
+    return app
+
+@pytest.fixture
+def client(db):
+    return db.test_client()
+
+# This skips a test unless TEST_MONGO_HOST points at a real MongoDB
+needsMongo = pytest.mark.skipif(not TEST_MONGO_HOST, reason='needs a real MongoDB (set TEST_MONGO_HOST)')
+
+# A client that is logged in as a new user
+@pytest.fixture
+def user(db):
+    from app.classes.data import User
+    return User(username='tester', email='tester@example.com', fname='Test', lname='User').save()
+
+@pytest.fixture
+def loggedIn(client, user):
+    # Flask-Login keeps the user's id in the session, so there is no need to check a password
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+DB_COMMANDS = re.compile(r'db;dur=[\d.]+;desc="(\d+) commands"')
+# The mongomock methods that stand for one database command each
+MOCK_COMMANDS = ('find', 'find_one', 'aggregate', 'count_documents', 'estimated_document_count',
+                 'distinct', 'insert_one', 'insert_many', 'update_one', 'update_many',
+                 'delete_one', 'delete_many', 'bulk_write', 'find_one_and_update', 'find_one_and_delete')
+
+# get(path) sends a GET and returns (response, number of database commands it sent).
+# A real MongoDB reports the number in the Server-Timing header (see app/utils/dbmetrics.py).
+# mongomock doesn't send commands, so its methods are counted instead.
+@pytest.fixture
+def countCommands(monkeypatch):
+    counted = [0]
+    if not TEST_MONGO_HOST:
+        from mongomock.collection import Collection
+        def counting(method):
+            def wrapper(*args, **kwargs):
+                counted[0] += 1
+                return method(*args, **kwargs)
+            return wrapper
+        for name in MOCK_COMMANDS:
+            monkeypatch.setattr(Collection, name, counting(getattr(Collection, name)))
+
+    def get(client, path):
+        counted[0] = 0
+        rv = client.get(path)
+        if TEST_MONGO_HOST:
+            return rv, int(DB_COMMANDS.search(rv.headers['Server-Timing']).group(1))
+        return rv, counted[0]
+    return get
@@ -0,0 +1,102 @@
+# The async read server (app/asyncread) must send the same pages as the Flask site.
+# Each test sends the same requests to both and compares them.
+
+import asyncio
+from io import BytesIO
+import pytest
+from PIL import Image
+from app.classes.data import User, Post, Comment, StoryPage
+from tests.conftest import TEST_MONGO_HOST
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp.test_utils import TestServer, TestClient
+from app.asyncread import createAsyncApp
+
+def motorClient():
+    # With mongomock the async server reads the same in-memory data through mongomock_motor.
+    # With a real MongoDB it makes its own motor client.
+    if TEST_MONGO_HOST:
+        return None
+    import mongomock
+    from mongoengine import get_connection
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    # A second mongomock client on the same data, because mongomock_motor changes the
+    # collections of the client it is given
+    return mongomock_motor.AsyncMongoMockClient(mock_mongo_client=mongomock.MongoClient(_store=get_connection()._store))
+
+# This sends GET requests for paths to the async server with the cookies of the Flask
+# test client and returns [(response, body)]
+def asyncGet(flaskClient, *paths, headers=None):
+    async def run():
+        async with TestClient(TestServer(createAsyncApp(client=motorClient()))) as client:
+            client.session.cookie_jar.update_cookies({c.name: c.value for c in flaskClient.cookie_jar})
+            results = []
+            for path in paths:
+                rv = await client.get(path, headers=headers, allow_redirects=False)
+                results.append((rv, await rv.read()))
+            return results
+    return asyncio.run(run())
+
+def reply(parent, author, content):
+    return Comment(author=author, post=parent.post, parent=parent, ancestors=parent.ancestors + [parent.id],
+                   depth=parent.depth + 1, content=content).save()
+
+def png():
+    out = BytesIO()
+    Image.new('L', (10, 10)).save(out, format='PNG')
+    out.seek(0)
+    return out
+
+def test_pages_are_the_same_as_the_flask_site(app, loggedIn, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'POSTS_PER_PAGE', 2)
+    monkeypatch.setitem(app.config, 'REPLIES_PER_PAGE', 2)
+    other = User(username='other', email='other@example.com').save()
+    posts = [Post(author=author, subject=f'post {i}', content='text').save() for i, author in enumerate([user, other, user])]
+    thread = Comment(author=other, post=posts[0], content='thread').save()
+    for i in range(3):
+        reply(thread, user, f'reply {i}')
+    end = StoryPage(author=other, title='end').save()
+    start = StoryPage(author=user, title='start', content='text', c1=end).save()
+    start.image.put(png(), content_type='image/png')
+    start.save()
+    paths = ['/post/list', '/post/list?sort=active&size=1', f'/post/{posts[0].id}',
+             f'/post/{posts[0].id}?thread={thread.id}', f'/page/{start.id}', f'/page/{end.id}', '/pages']
+    nextPage = loggedIn.get('/post/list').get_data(as_text=True).split('after=')[1].split('"')[0]
+    paths.append(f'/post/list?after={nextPage}')
+    # a flashed message is shown on the first page (by both servers, they each get the cookie)
+    with loggedIn.session_transaction() as session:
+        session['_flashes'] = [('message', 'Hello there')]
+    results = asyncGet(loggedIn, *paths)
+    assert 'Hello there' in results[0][1].decode()
+    for path, (rv, body) in zip(paths, results):
+        assert rv.status == 200, path
+        assert body.decode() == loggedIn.get(path).get_data(as_text=True), path
+
+def test_login_is_required(client, user):
+    post = Post(author=user, subject='post').save()
+    user.image.put(png(), content_type='image/png')
+    user.save()
+    for path in ['/post/list', f'/post/{post.id}', f'/image/user/{user.id}']:
+        [(rv, body)] = asyncGet(client, path)
+        assert rv.status == 302
+        assert rv.headers['Location'] == '/login?next=' + path.replace('/', '%2F')
+
+def test_images(loggedIn, user):
+    page = StoryPage(author=user, title='start')
+    page.image.put(png(), content_type='image/png')
+    page.save()
+    user.image.put(png(), content_type='image/png')
+    user.save()
+    pagePath, userPath = f'/image/page/{page.id}/card', f'/image/user/{user.id}'
+    (pageImage, pageBody), (userImage, userBody) = asyncGet(loggedIn, pagePath, userPath)
+    for rv, body, path in [(pageImage, pageBody, pagePath), (userImage, userBody, userPath)]:
+        flaskRV = loggedIn.get(path)
+        assert rv.status == 200
+        assert body == flaskRV.get_data()
+        assert rv.headers['Content-Type'] == 'image/png'
+        assert rv.headers['ETag'] == flaskRV.headers['ETag']
+    assert 'public' in pageImage.headers['Cache-Control']
+    assert 'private' in userImage.headers['Cache-Control']
+
+    [(rv, body)] = asyncGet(loggedIn, pagePath, headers={'If-None-Match': pageImage.headers['ETag']})
+    assert rv.status == 304 and body == b''
@@ -0,0 +1,40 @@
+# Deleting comments and the 'see all replies' link on the post page
+
+from app.classes.data import User, Post, Comment
+
+def reply(parent, author, content):
+    return Comment(author=author, post=parent.post, parent=parent, ancestors=parent.ancestors + [parent.id],
+                   depth=parent.depth + 1, content=content).save()
+
+def test_only_the_author_can_delete_a_comment(loggedIn, user):
+    other = User(username='other', email='other@example.com').save()
+    post = Post(author=other, subject='post').save()
+    theirs = Comment(author=other, post=post, content='theirs').save()
+    answer = reply(theirs, user, 'answer')
+
+    rv = loggedIn.get(f'/comment/delete/{theirs.id}')
+    assert rv.status_code == 302
+    assert Comment.objects.count() == 2
+
+    loggedIn.get(f'/comment/delete/{answer.id}')
+    assert [c.content for c in Comment.objects] == ['theirs']
+
+def test_see_all_replies_only_for_cut_off_threads(app, loggedIn, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'REPLIES_PER_PAGE', 3)
+    post = Post(author=user, subject='post').save()
+    short = Comment(author=user, post=post, content='short thread').save()
+    long = Comment(author=user, post=post, content='long thread').save()
+    # the short thread's one reply is older so it is shown, the long thread is cut off
+    reply(short, user, 'short reply')
+    for i in range(4):
+        reply(long, user, f'long reply {i}')
+
+    html = loggedIn.get(f'/post/{post.id}').get_data(as_text=True)
+    assert html.count('see all replies') == 1
+    assert f'thread={long.id}' in html
+    assert f'thread={short.id}' not in html
+
+    # the thread's own page shows its replies REPLIES_PER_PAGE at a time
+    html = loggedIn.get(f'/post/{post.id}?thread={long.id}').get_data(as_text=True)
+    assert 'long reply 2' in html
+    assert 'more comments' in html
@@ -0,0 +1,28 @@
+# 'flask data import' can be run again after it stops, so documents that are already
+# there are skipped. Anything else that clashes must stop the import.
+
+from app.classes.data import User
+
+def test_import_stops_on_a_different_user_with_the_same_username(app, db, tmp_path):
+    runner = app.test_cli_runner()
+    User(username='same', email='same@example.com').save()
+    assert runner.invoke(args=['data', 'export', str(tmp_path)]).exit_code == 0
+
+    # A resumed import finds the same documents and carries on
+    result = runner.invoke(args=['data', 'import', str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert User.objects.count() == 1
+
+    # A different user (another _id) with the same username is not 'already imported'
+    User.drop_collection()
+    User.ensure_indexes()
+    other = User(username='same', email='other@example.com').save()
+    result = runner.invoke(args=['data', 'import', str(tmp_path)])
+    assert result.exit_code != 0
+    assert 'unique field' in result.output
+    assert [u.id for u in User.objects] == [other.id]
+
+def test_import_from_an_empty_folder(app, db, tmp_path):
+    result = app.test_cli_runner().invoke(args=['data', 'import', str(tmp_path)])
+    assert result.exit_code != 0
+    assert 'No exported files' in result.output
@@ -0,0 +1,56 @@
+# Checks on uploaded images in app/utils/images.py
+
+from io import BytesIO
+import pytest
+from PIL import Image
+from app.utils.images import openImage
+
+def png(width, height):
+    out = BytesIO()
+    Image.new('L', (width, height)).save(out, format='PNG')
+    out.seek(0)
+    return out
+
+def test_rejects_images_over_the_pixel_limit(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_IMAGE_PIXELS', 100 * 100)
+    assert openImage(png(100, 100)).size == (100, 100)
+    # more than the limit but less than twice it, which Pillow itself would only warn about
+    with pytest.raises(ValueError, match='too big'):
+        openImage(png(150, 100))
+
+def test_variants_follow_exif_orientation():
+    from app.utils.images import makeVariant
+    exif = Image.Exif()
+    # 6 means 'turn 90 degrees clockwise to show it'
+    exif[0x0112] = 6
+    out = BytesIO()
+    Image.new('RGB', (400, 200)).save(out, format='JPEG', exif=exif)
+    out.seek(0)
+    img = openImage(out)
+    assert img.size == (200, 400)
+    data, contentType = makeVariant(img, 100)
+    assert Image.open(BytesIO(data)).size == (50, 100)
+
+def storeImage(doc):
+    doc.image.put(png(10, 10), content_type='image/png')
+    doc.save()
+
+def test_profile_pictures_need_a_login(client, user):
+    storeImage(user)
+    rv = client.get(f'/image/user/{user.id}')
+    assert rv.status_code == 302
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    rv = client.get(f'/image/user/{user.id}')
+    assert rv.status_code == 200
+    # shared caches must not keep a copy of a picture that needs a login
+    assert rv.cache_control.private and not rv.cache_control.public
+
+def test_story_pictures_stay_public(client, user):
+    from app.classes.data import StoryPage
+    page = StoryPage(title='Start', content='x', author=user)
+    storeImage(page)
+    rv = client.get(f'/image/page/{page.id}')
+    assert rv.status_code == 200
+    assert rv.cache_control.public
@@ -0,0 +1,23 @@
+# Every query that the busy pages send has to be answered with an index. A query that
+# makes MongoDB read the whole collection (a 'COLLSCAN') is fine with a few posts and
+# gets slower with every one added. Only a real MongoDB can say how it would run a
+# query, so most of these are skipped unless TEST_MONGO_HOST is set (see conftest.py).
+
+from app.commands import hotQueries, hasCollectionScan
+from tests.conftest import needsMongo
+
+def test_finds_collection_scan_anywhere_in_plan():
+    plan = {'winningPlan': {'stage': 'LIMIT', 'inputStage': {'stage': 'SORT_MERGE', 'inputStages': [
+        {'stage': 'IXSCAN'}, {'stage': 'FETCH', 'inputStage': {'stage': 'COLLSCAN'}}]}}}
+    assert hasCollectionScan(plan)
+    plan['winningPlan']['inputStage']['inputStages'][1]['inputStage']['stage'] = 'IXSCAN'
+    assert not hasCollectionScan(plan)
+
+@needsMongo
+def test_hot_queries_use_an_index(db):
+    scans = []
+    for name, queryset in hotQueries().items():
+        plan = queryset.explain()
+        if hasCollectionScan(plan.get('queryPlanner', plan)):
+            scans.append(name)
+    assert scans == [], 'these queries read the whole collection'
@@ -0,0 +1,117 @@
+# The mail workers are tested against a tiny SMTP server running in the test, so the
+# real sending code (and the retries) run instead of MAIL_SUPPRESS_SEND.
+
+import importlib
+import socketserver
+import threading
+import time
+import pytest
+from app import mail
+
+# 'from app.routes import mail' would give the Mail object because routes/__init__.py
+# does 'from .mail import *', so the module is looked up by its full name
+outbox = importlib.import_module('app.routes.mail')
+
+# A very small SMTP server. The first 'busy' connections are turned away with 421
+# ('try again later') and the rest are accepted and their messages kept in 'received'.
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            busy = server.connections <= server.busy
+        if busy:
+            self.reply('421 busy, try again later')
+            return
+        self.reply('220 test ready')
+        data = None
+        for line in self.rfile:
+            line = line.decode().rstrip('\r\n')
+            if data is not None:
+                if line == '.':
+                    server.received.append('\n'.join(data))
+                    data = None
+                    self.reply('250 queued')
+                else:
+                    data.append(line)
+            elif line.upper().startswith('DATA'):
+                data = []
+                self.reply('354 go ahead')
+            elif line.upper().startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+@pytest.fixture
+def smtp(app):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.busy = 0
+    server.received = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings = dict(MAIL_SERVER='127.0.0.1', MAIL_PORT=server.server_address[1], MAIL_USE_TLS=False,
+                    MAIL_USE_SSL=False, MAIL_SUPPRESS_SEND=False, MAIL_RETRY_DELAY=0.05,
+                    MAIL_MAX_RETRIES=3, MAIL_USERNAME=None, MAIL_PASSWORD=None)
+    old = {name: app.config.get(name) for name in settings}
+    app.config.update(settings)
+    # Flask-Mail reads its settings when it is set up, so it is set up again
+    mail.init_app(app)
+    yield server
+    server.shutdown()
+    server.server_close()
+    app.config.update(old)
+    mail.init_app(app)
+
+def waitFor(condition, seconds=5):
+    end = time.monotonic() + seconds
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.02)
+    return condition()
+
+def send(subject):
+    return outbox.send_email(subject, 'site@example.com', ['someone@example.com'], 'text', '<p>html</p>')
+
+def test_email_is_sent(smtp):
+    before = outbox.mailStats()
+    assert send('hello')
+    assert waitFor(lambda: outbox.mailStats()['sent'] == before['sent'] + 1)
+    assert 'Subject: hello' in smtp.received[0]
+
+def test_busy_server_is_retried(smtp):
+    smtp.busy = 2
+    before = outbox.mailStats()
+    assert send('retried')
+    assert waitFor(lambda: outbox.mailStats()['sent'] == before['sent'] + 1)
+    stats = outbox.mailStats()
+    assert stats['retried'] == before['retried'] + 2
+    assert stats['failed'] == before['failed']
+    assert len(smtp.received) == 1
+
+def test_gives_up_after_max_retries(smtp):
+    smtp.busy = 100
+    before = outbox.mailStats()
+    assert send('never')
+    assert waitFor(lambda: outbox.mailStats()['failed'] == before['failed'] + 1)
+    assert outbox.mailStats()['retried'] == before['retried'] + 3
+    assert smtp.received == []
+
+def test_unexpected_error_is_counted_and_worker_keeps_going(smtp, monkeypatch):
+    realSend = mail.send
+    def brokenSend(msg):
+        if msg.subject == 'broken':
+            raise ValueError('bad message')
+        return realSend(msg)
+    monkeypatch.setattr(mail, 'send', brokenSend)
+    before = outbox.mailStats()
+    assert send('broken')
+    assert waitFor(lambda: outbox.mailStats()['failed'] == before['failed'] + 1)
+    assert 'bad message' in outbox.mailStats()['lastError']
+    # the workers are still running
+    assert send('after')
+    assert waitFor(lambda: outbox.mailStats()['sent'] == before['sent'] + 1)
@@ -0,0 +1,36 @@
+# The pages kept by renderStatic() link to the fingerprinted files from the last
+# 'flask assets build'. A new build has to throw those pages away.
+
+import json
+import os
+import pytest
+from app.utils import pagecache
+
+@pytest.fixture
+def assetDir(app, tmp_path):
+    old = app.config['ASSET_DIR'], app.config['PAGE_CACHE_CHECK_INTERVAL']
+    app.config['ASSET_DIR'] = str(tmp_path)
+    # look for changes on every request
+    app.config['PAGE_CACHE_CHECK_INTERVAL'] = 0
+    yield tmp_path
+    app.config['ASSET_DIR'], app.config['PAGE_CACHE_CHECK_INTERVAL'] = old
+    pagecache._pages.clear()
+
+def writeManifest(folder, built, mtime):
+    path = os.path.join(folder, 'manifest.json')
+    with open(path, 'w') as f:
+        json.dump({'local.css': built}, f)
+    # the build could finish within the same clock tick as the last one
+    os.utime(path, (mtime, mtime))
+
+def test_new_build_empties_page_cache(client, assetDir):
+    writeManifest(assetDir, 'local.1111.css', 1000000)
+    assert b'local.1111.css' in client.get('/').data
+    writeManifest(assetDir, 'local.2222.css', 2000000)
+    html = client.get('/').data
+    assert b'local.2222.css' in html
+    assert b'local.1111.css' not in html
+
+def test_page_cache_is_used(client, assetDir):
+    client.get('/aboutus')
+    assert 'aboutus.html' in pagecache._pages
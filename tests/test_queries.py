@@ -0,0 +1,49 @@
+# The post list and the post page load the authors of all of their posts and comments
+# with one query (loadAuthors() in app/routes/forum.py). If a template touched
+# post.author directly again each row would cost another query, so these tests check
+# that the number of database commands stays the same however many rows there are.
+
+import itertools
+from app.classes.data import User, Post, Comment
+
+# every user made by these tests gets a new number so usernames are never repeated
+_numbers = itertools.count()
+
+def makeUsers(count, prefix):
+    users = []
+    for i in range(count):
+        name = f'{prefix}{next(_numbers)}'
+        users.append(User(username=name, email=f'{name}@example.com').save())
+    return users
+
+def makePosts(count):
+    return [Post(author=author, subject=f'post {i}', content='text').save()
+            for i, author in enumerate(makeUsers(count, 'poster'))]
+
+def makeComments(post, count):
+    return [Comment(author=author, post=post, content=f'comment {i}').save()
+            for i, author in enumerate(makeUsers(count, 'commenter'))]
+
+def test_post_list_commands_dont_grow_with_posts(loggedIn, countCommands):
+    makePosts(3)
+    loggedIn.get('/post/list')
+    rv, few = countCommands(loggedIn, '/post/list')
+    assert rv.status_code == 200
+    makePosts(20)
+    rv, many = countCommands(loggedIn, '/post/list')
+    assert rv.status_code == 200
+    assert b'post 19' in rv.data
+    assert many == few
+
+def test_post_page_commands_dont_grow_with_comments(loggedIn, countCommands):
+    post = makePosts(1)[0]
+    makeComments(post, 2)
+    path = f'/post/{post.id}'
+    loggedIn.get(path)
+    rv, few = countCommands(loggedIn, path)
+    assert rv.status_code == 200
+    makeComments(post, 15)
+    rv, many = countCommands(loggedIn, path)
+    assert rv.status_code == 200
+    assert rv.data.count(b'comment ') >= 15
+    assert many == few
@@ -0,0 +1,35 @@
+# The c1/c2 choices of a story page come from the browser so they are checked
+
+from app.classes.data import StoryPage
+
+def test_bad_choice_is_a_form_error(loggedIn, user):
+    target = StoryPage(author=user, title='target').save()
+    for bad in ('not-an-id', '5f0000000000000000000000'):
+        rv = loggedIn.post('/page/new', data={'title': 'start', 'content': 'text', 'c1': bad, 'c2': ''})
+        assert rv.status_code == 200
+        assert 'That page does not exist' in rv.get_data(as_text=True)
+    assert StoryPage.objects.count() == 1
+
+    rv = loggedIn.post('/page/new', data={'title': 'start', 'content': 'text', 'c1': str(target.id), 'c2': ''})
+    assert rv.status_code == 302
+    assert StoryPage.objects.get(title='start')._data['c1'].id == target.id
+
+# Saving the edit form without touching the dropdowns keeps the choices, even when the
+# chosen page has no title or is newer than the story graph.
+def test_edit_keeps_choices(loggedIn, user):
+    from app.utils.storygraph import getStoryGraph
+    getStoryGraph()
+    untitled = StoryPage(author=user).save()
+    titled = StoryPage(author=user, title='later').save()
+    start = StoryPage(author=user, title='start', content='text', c1=untitled, c2=titled).save()
+
+    html = loggedIn.get(f'/page/edit/{start.id}').get_data(as_text=True)
+    assert f'<option selected value="{untitled.id}">(untitled page)</option>' in html
+    assert f'<option selected value="{titled.id}">later</option>' in html
+
+    rv = loggedIn.post(f'/page/edit/{start.id}', data={'title': 'start', 'content': 'text',
+                                                       'c1': str(untitled.id), 'c2': str(titled.id)})
+    assert rv.status_code == 302
+    start.reload()
+    assert start._data['c1'].id == untitled.id
+    assert start._data['c2'].id == titled.id
@@ -0,0 +1,52 @@
+# Users are kept unique by the unique indexes on username and email, so the site
+# must not take traffic without them, and 'flask users import' shouldn't spend time
+# hashing the passwords of rows that won't be inserted.
+
+import pytest
+from app import commands
+from app.utils import users
+from app.classes.data import User
+
+@pytest.fixture
+def noIndexes(db, monkeypatch):
+    User._get_collection().drop_indexes()
+    monkeypatch.setattr(users, '_uniqueIndexesFound', False)
+
+def test_readyz_needs_unique_indexes(client, noIndexes):
+    rv = client.get('/readyz')
+    assert rv.status_code == 503
+    assert rv.get_json()['indexes'] == 'missing'
+    User.ensure_indexes()
+    assert client.get('/readyz').status_code == 200
+
+def test_import_refuses_without_unique_indexes(app, noIndexes, tmp_path):
+    path = tmp_path / 'users.csv'
+    path.write_text('username,email\nnew,new@example.com\n')
+    result = app.test_cli_runner().invoke(args=['users', 'import', str(path)])
+    assert result.exit_code != 0
+    assert 'flask db indexes' in result.output
+    assert User.objects.count() == 0
+
+def test_import_only_hashes_rows_it_inserts(app, db, tmp_path, monkeypatch):
+    User(username='taken', email='taken@example.com').save()
+    hashed = []
+    def hashPasswords(passwords, workers=None):
+        hashed.extend(passwords)
+        return [f'hash-{password}' for password in passwords]
+    monkeypatch.setattr(commands, 'hashPasswords', hashPasswords)
+    path = tmp_path / 'users.csv'
+    path.write_text('username,email,password\n'
+                    'alice,alice@example.com,pw-alice\n'
+                    'bob,not an email,pw-bob\n'
+                    'alice,other@example.com,pw-alice-again\n'
+                    'taken,someone@example.com,pw-taken\n'
+                    'carol,taken@example.com,pw-carol\n'
+                    'dave,dave@example.com,\n')
+    result = app.test_cli_runner().invoke(args=['users', 'import', str(path)])
+    assert result.exit_code == 0, result.output
+    assert '2 users created' in result.output
+    assert hashed == ['pw-alice']
+    assert User.objects.get(username='alice').password_hash == 'hash-pw-alice'
+    assert User.objects.get(username='dave').password_hash is None
+    for line in (3, 4, 5, 6):
+        assert f'line {line}:' in result.output